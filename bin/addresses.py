@@ -0,0 +1,89 @@
+# addresses
+#
+# Snort IPv4 address specs compiled to sorted, disjoint, inclusive
+# (low, high) intervals of integer addresses, the same way ports.py does
+# ports:
+#
+#   any  10.0.0.1  192.168.0.0/16  !$HOME_NET  [$HOME_NET,!10.1.0.0/16]
+#
+# and a prefix trie mapping an address (an int, host byte order, as in
+# pcapscan's 5-tuples) to the bitset of rules whose spec contains it.
+import ipaddress
+from ports import normalize, split_list, subtract
+
+MAX_ADDRESS = 2 ** 32 - 1
+ANY = ((0, MAX_ADDRESS),)
+
+def parse_addresses(spec, ip_vars=None, _seen=()):
+    if ip_vars is None:
+        ip_vars = {}
+    spec = spec.strip()
+    if spec.startswith('!'):
+        return subtract(ANY, parse_addresses(spec[1:], ip_vars, _seen), MAX_ADDRESS)
+    if spec == 'any':
+        return ANY
+    if spec.startswith('$'):
+        name = spec[1:]
+        if name not in ip_vars:
+            raise ValueError(f"undefined address variable {spec}")
+        if name in _seen:
+            raise ValueError(f"address variable {spec} refers to itself")
+        value = ip_vars[name]
+        if isinstance(value, tuple):
+            # already compiled (variables.Variables.addresses)
+            return value
+        return parse_addresses(value, ip_vars, _seen + (name,))
+    if spec.startswith('[') and spec.endswith(']'):
+        included = []
+        excluded = []
+        for item in split_list(spec[1:-1]):
+            if item.startswith('!'):
+                excluded.extend(parse_addresses(item[1:], ip_vars, _seen))
+            else:
+                included.extend(parse_addresses(item, ip_vars, _seen))
+        base = normalize(included) if included else ANY
+        return subtract(base, normalize(excluded), MAX_ADDRESS)
+    # IPv6 specs raise here too; callers treat them as unconstrained
+    network = ipaddress.IPv4Network(spec, strict=False)
+    return ((int(network.network_address), int(network.broadcast_address)),)
+
+def prefixes(low, high):
+    # The fewest CIDR blocks (network, prefix length) covering low..high
+    blocks = []
+    while low <= high:
+        size = (low & -low) if low else MAX_ADDRESS + 1
+        while size > high - low + 1:
+            size >>= 1
+        blocks.append((low, 33 - size.bit_length()))
+        low += size
+    return blocks
+
+class AddressTrie:
+    # Binary trie over address bits; a node's bitset holds the rules that
+    # cover its whole prefix, so a lookup ORs the bitsets along the path
+    def __init__(self):
+        self.root = [None, None, 0]
+
+    def insert(self, network, length, bits):
+        node = self.root
+        for depth in range(length):
+            branch = (network >> (31 - depth)) & 1
+            if node[branch] is None:
+                node[branch] = [None, None, 0]
+            node = node[branch]
+        node[2] |= bits
+
+    def add(self, intervals, bits):
+        for low, high in intervals:
+            for network, length in prefixes(low, high):
+                self.insert(network, length, bits)
+
+    def lookup(self, address):
+        node = self.root
+        bits = node[2]
+        for shift in range(31, -1, -1):
+            node = node[(address >> shift) & 1]
+            if node is None:
+                break
+            bits |= node[2]
+        return bits
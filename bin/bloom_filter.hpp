@@ -7,6 +7,13 @@
 #include <cstdint>
 #include <stdexcept>
 
+inline uint64_t splitmix64(uint64_t x) {
+    x += 0x9E3779B97F4A7C15ULL;
+    x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    x = (x ^ (x >> 27)) * 0x94D049BB133111EBULL;
+    return x ^ (x >> 31);
+}
+
 class BloomFilter {
 public:
     BloomFilter(size_t size = 12) : size(size), bitArray(size, 0) {}
@@ -36,13 +43,14 @@ public:
     size_t size;
     std::vector<uint8_t> bitArray;
 
+    // Kirsch-Mitzenmacher double hashing, g_i = h1 + i * h2. Must stay
+    // bit-identical with DoubleHash in bloom_filter.py.
     std::vector<uint64_t> _hash(int value) const {
         std::vector<uint64_t> hashValues;
-        std::hash<std::string> hashFn;
-        for (size_t i = 0; i < 4; ++i) {
-            std::string input = std::to_string(value) + std::to_string(i);
-            size_t hashValue = hashFn(input);
-            hashValues.push_back(hashValue);
+        uint64_t h1 = splitmix64(static_cast<uint64_t>(static_cast<int64_t>(value)));
+        uint64_t h2 = splitmix64(h1);
+        for (uint64_t i = 0; i < 4; ++i) {
+            hashValues.push_back(h1 + i * h2);
         }
         return hashValues;
     }
@@ -72,12 +80,14 @@ public:
             throw std::invalid_argument("Bloom filters must be of the same size");
         }
 
-        BloomFilter result(filters[ruleId].getSize());
+        // True when the filters are identical, as BloomFilterArray.xor in
+        // bloom_filter.py
         for (size_t i = 0; i < filters[ruleId].getSize(); ++i) {
-            uint8_t bit = filters[ruleId].bitArray[i] ^ otherFilter.bitArray[i];
-            result.bitArray[i] = bit;
+            if (filters[ruleId].bitArray[i] ^ otherFilter.bitArray[i]) {
+                return false;
+            }
         }
-        return result.contains(1);  
+        return true;
     }
 
 // private:
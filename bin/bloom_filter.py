@@ -1,58 +1,108 @@
 # bloom_filter
 import hashlib
 
-class BloomFilter:
-    def __init__(self, size=12):
-        self.size = size
-        self.bit_array = [0] * size
+MASK64 = (1 << 64) - 1
 
-    def add(self, value):
-        hashes = self._hash(value)
-        for hash_value in hashes:
-            index = hash_value % self.size
-            self.bit_array[index] = 1
+def splitmix64(x):
+    x = (x + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
 
-    def contains(self, value):
-        hashes = self._hash(value)
-        for hash_value in hashes:
-            index = hash_value % self.size
-            if self.bit_array[index] == 0:
-                return False
-        return True
+class DoubleHash:
+    # Kirsch-Mitzenmacher: g_i = h1 + i * h2, two splitmix64 rounds give h1
+    # and h2. Must stay bit-identical with BloomFilter::_hash in
+    # bloom_filter.hpp so the Python and C++ filters can be cross-checked.
+    def __init__(self, num_hashes=4):
+        self.num_hashes = num_hashes
 
-    def _hash(self, value):
+    def __call__(self, value):
+        h1 = splitmix64(int(value) & MASK64)
+        h2 = splitmix64(h1)
+        return [(h1 + i * h2) & MASK64 for i in range(self.num_hashes)]
+
+class Sha256Hash:
+    # Original scheme, kept for comparing against filters built before the
+    # switch to DoubleHash
+    def __init__(self, num_hashes=4):
+        self.num_hashes = num_hashes
+
+    def __call__(self, value):
         hash_values = []
-        for i in range(4):
+        for i in range(self.num_hashes):
             hash_fn = hashlib.sha256()
             hash_fn.update(str(value).encode('utf-8'))
             hash_fn.update(str(i).encode('utf-8'))  # Add variation
             hash_value = int.from_bytes(hash_fn.digest(), byteorder='big')
             hash_values.append(hash_value)
         return hash_values
-    
+
+class BloomFilter:
+    def __init__(self, size=12, hasher=None):
+        self.size = size
+        self.hasher = hasher if hasher is not None else DoubleHash()
+        # bit i of the int is slot i of the filter
+        self.bits = 0
+
+    def add(self, value):
+        self.bits |= self.mask(value)
+
+    def contains(self, value):
+        mask = self.mask(value)
+        return self.bits & mask == mask
+
+    def mask(self, value):
+        mask = 0
+        for hash_value in self._hash(value):
+            mask |= 1 << (hash_value % self.size)
+        return mask
+
+    @property
+    def bit_array(self):
+        return [(self.bits >> i) & 1 for i in range(self.size)]
+
+    def _hash(self, value):
+        return self.hasher(value)
+
 class BloomFilterArray:
-    def __init__(self, num_filters=41):
+    def __init__(self, num_filters=41, size=12, hasher=None):
         self.num_filters = num_filters
-        self.filters = [BloomFilter() for _ in range(num_filters)]
+        self.size = size
+        self.hasher = hasher if hasher is not None else DoubleHash()
+        # All filters live bit-packed in one buffer, filter i at byte i * stride
+        self.stride = (size + 7) // 8
+        self.buffer = bytearray(num_filters * self.stride)
+
+    def get(self, rule_id):
+        offset = rule_id * self.stride
+        return int.from_bytes(self.buffer[offset:offset + self.stride], 'little')
+
+    def set(self, rule_id, bits):
+        offset = rule_id * self.stride
+        self.buffer[offset:offset + self.stride] = bits.to_bytes(self.stride, 'little')
+
+    def mask(self, value):
+        mask = 0
+        for hash_value in self.hasher(value):
+            mask |= 1 << (hash_value % self.size)
+        return mask
 
     def add(self, rule_id, patterns):
+        bits = self.get(rule_id)
         for pattern in patterns:
-            self.filters[rule_id].add(pattern)
+            bits |= self.mask(pattern)
+        self.set(rule_id, bits)
 
     def contains(self, rule_id, patterns):
+        bits = self.get(rule_id)
         for pattern in patterns:
-            if not self.filters[rule_id].contains(pattern):
-                    return False
+            mask = self.mask(pattern)
+            if bits & mask != mask:
+                return False
         return True
-    
+
     def xor(self, rule_id, other_filter):
-        l = self.filters[rule_id].size
-        if l != other_filter.size:
+        if self.size != other_filter.size:
             raise ValueError("Bloom filters must be of the same size")
-        
-        result = BloomFilter(l)
-        for i in range(l):
-            result.bit_array[i] = self.filters[rule_id].bit_array[i] ^ other_filter.bit_array[i]
-            if result.bit_array[i]:
-                return False
-        return True
\ No newline at end of file
+        # Equal filters XOR to zero, compared word-wide rather than bit by bit
+        return self.get(rule_id) ^ other_filter.bits == 0
@@ -0,0 +1,100 @@
+# fast_pattern
+#
+# Picks each rule's fast pattern: the one literal fed to the Hyperscan
+# prefilter (fast_literals.txt). A rule's other literals only matter once its
+# fast pattern hit, since the rule cannot be confirmed without it.
+#
+# Report the effect on captures already scanned with the full literals.txt:
+#   python fast_pattern.py eternalblue.jsonl blackhole.jsonl
+import argparse
+import collections
+import math
+from match_reader import iter_matches
+from ruleset import Ruleset
+
+def entropy(literal):
+    # Shannon entropy of the byte distribution, 0 to 8 bits per byte
+    counts = collections.Counter(literal)
+    n = len(literal)
+    return -sum(c / n * math.log2(c / n) for c in counts.values())
+
+def literal_score(literal, frequency):
+    # Long, varied literals shared by few rules are the least likely to hit
+    # on arbitrary traffic. Length stops paying past 32 bytes.
+    return min(len(literal), 32) + 2 * entropy(literal) - 4 * math.log2(1 + frequency)
+
+def select_fast_patterns(rule_table, string_table, strings):
+    # Sets rule_table[r]['fast'] to the str_id of rule r's fast pattern, or
+    # None for a rule without literals. An explicit fast_pattern modifier in
+    # the rule wins over the score. A rule with only pcres gets its first
+    # regex, so the prefilter still lets its packets through.
+    scores = {}
+    for str_id, entry in string_table.items():
+        if not entry.get('regex'):
+            scores[str_id] = literal_score(strings[str_id - 1], len(entry['rids']))
+
+    for r_id, entry in rule_table.items():
+        literals = [str_id for str_id in entry['str_id'] if str_id in scores]
+        if entry.get('fast_pattern') is not None:
+            entry['fast'] = entry['fast_pattern']
+        elif literals:
+            entry['fast'] = max(literals, key=lambda str_id: scores[str_id])
+        elif entry['str_id']:
+            entry['fast'] = entry['str_id'][0]
+        else:
+            entry['fast'] = None
+    return {entry['fast'] for entry in rule_table.values() if entry['fast'] is not None}
+
+def make_gate(ruleset):
+    # gate(str_ids) -> the str ids pcapscan -f reports for a packet whose
+    # full scan matched str_ids: the fast patterns that hit, and the other
+    # literals of rules whose fast pattern hit
+    fast_ids = {ruleset.rule_fast[r] for r in range(1, ruleset.num_rules)} - {0}
+    rule_fasts = {}
+    for r in range(1, ruleset.num_rules):
+        fast = ruleset.rule_fast[r]
+        if fast:
+            for str_id in ruleset.rule_strings(r):
+                if str_id not in fast_ids:
+                    rule_fasts.setdefault(str_id, set()).add(fast)
+
+    def gate(str_ids):
+        fast_hits = {str_id for str_id in str_ids if str_id in fast_ids}
+        if not fast_hits:
+            return []
+        return sorted(fast_hits.union(str_id for str_id in str_ids
+                                      if str_id in rule_fasts and not rule_fasts[str_id].isdisjoint(fast_hits)))
+    return fast_ids, gate
+
+def report(ruleset, match_files):
+    # For matches produced with the full literal set, how many survive when
+    # only fast patterns are scanned, then the other literals only in packets
+    # where a fast pattern hit, kept only for rules whose fast pattern hit
+    fast_ids, gate = make_gate(ruleset)
+    print(f'fast patterns: {len(fast_ids)} of {ruleset.num_strings - 1} literals')
+    print(f'{"matches":<30} {"packets":>8} {"gated":>8} {"full":>10} {"prefilter":>10} '
+          f'{"to filter":>10} {"scan cut":>9} {"filter cut":>10}')
+    for match_file in match_files:
+        packets = gated = full = prefilter = to_filter = 0
+        for pkt, str_ids in iter_matches(match_file):
+            packets += 1
+            fast_hits = sum(1 for str_id in str_ids if str_id in fast_ids)
+            full += len(str_ids)
+            prefilter += fast_hits
+            if fast_hits:
+                gated += 1
+                to_filter += len(gate(str_ids))
+        scan_cut = 1 - prefilter / full if full else 0.0
+        filter_cut = 1 - to_filter / full if full else 0.0
+        print(f'{match_file:<30} {packets:>8} {gated:>8} {full:>10} {prefilter:>10} '
+              f'{to_filter:>10} {scan_cut:>9.1%} {filter_cut:>10.1%}')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Report the match-rate reduction from fast pattern selection')
+    parser.add_argument('match_files', nargs='*', default=['matched_ids.jsonl'],
+                        help='per-packet match lists from pcapscan with the full literals.txt')
+    args = parser.parse_args(argv)
+    report(Ruleset('ruleset.bin'), args.match_files)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# Compare the bloom, exact and counter rule confirmation modes of rule_filter on the
+# pcapscan output of one or more captures, e.g. for each bundled pcap:
+#   ./pcapscan literals.txt pcap/eternalblue.pcap && cp matched_ids.jsonl eternalblue.jsonl
+#   python filter_bench.py eternalblue.jsonl blackhole.jsonl
+import argparse
+import time
+from match_reader import iter_matches
+from rule_filter import FILTER_MODES, make_matcher
+from ruleset import Ruleset
+
+def run_mode(match, match_table):
+    confirmed = []
+    for str_ids in match_table:
+        candidate_rules, filtered_rules = match(str_ids)
+        confirmed.append(filtered_rules)
+    return confirmed
+
+def bench(ruleset, match_files, repeat):
+    matchers = {mode: make_matcher(mode, ruleset) for mode in FILTER_MODES}
+    print(f'{"matches":<30} {"mode":<7} {"pkts/s":>12} {"confirmed":>10} {"false pos":>10} {"fp rate":>8}')
+    for match_file in match_files:
+        # Held in memory so every mode and repeat replays the same packets
+        match_table = [str_ids for pkt, str_ids in iter_matches(match_file)]
+
+        results = {}
+        for mode in FILTER_MODES:
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                confirmed = run_mode(matchers[mode], match_table)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[mode] = (best, confirmed)
+
+        # The exact bitset has no false positives, so anything only the Bloom
+        # check confirmed is one
+        exact = results['exact'][1]
+        for mode in FILTER_MODES:
+            elapsed, confirmed = results[mode]
+            total = sum(len(rules) for rules in confirmed)
+            false_pos = sum(len(set(rules) - set(truth)) for rules, truth in zip(confirmed, exact))
+            rate = false_pos / total if total else 0.0
+            pps = len(match_table) / elapsed if elapsed else float('inf')
+            print(f'{match_file:<30} {mode:<7} {pps:>12.0f} {total:>10} {false_pos:>10} {rate:>8.2%}')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark rule_filter confirmation modes')
+    parser.add_argument('match_files', nargs='*', default=['matched_ids.jsonl'],
+                        help='per-packet match lists written by pcapscan')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per mode, best is reported')
+    args = parser.parse_args(argv)
+
+    bench(Ruleset('ruleset.bin'), args.match_files, args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# groups
+#
+# Port groups: rules partitioned by protocol and the port set they apply to,
+# as Snort's port groups do, so a packet is scanned (pcapscan -g) and its
+# rules confirmed (rule_filter --groups) only against the groups its 5-tuple
+# selects. string_gen writes one literals file per group and a groups.json
+# manifest:
+#
+#   any              'ip' and service rules, selected for every packet
+#   <proto>_any      rules of one protocol without a usable port constraint
+#   <proto>_<ports>  rules whose destination port spec (else source port
+#                    spec) is <ports>, selected when either of the packet's
+#                    ports falls in it
+#
+# Each rule lands in exactly one group, and a group's file holds every
+# literal of its rules under the same str ids as literals.txt.
+import json
+import re
+from ports import ANY, in_ports, parse_ports
+
+MANIFEST = 'groups.json'
+GROUP_DIR = 'groups'
+
+PROTOCOLS = {1: 'icmp', 6: 'tcp', 17: 'udp'}
+
+def group_name(protocol, spec):
+    slug = re.sub(r'[^A-Za-z0-9,_-]+', '-', spec.replace('$', '').replace('!', 'not')).strip('-')
+    return f'{protocol}_{slug}'
+
+def port_key(src_port, dst_port, port_vars=None):
+    # (spec, intervals) a rule is grouped under, None when neither side
+    # narrows it. An undefined variable leaves its side unconstrained.
+    for spec in (dst_port, src_port):
+        if not spec:
+            continue
+        try:
+            intervals = parse_ports(spec, port_vars)
+        except ValueError:
+            continue
+        if intervals != ANY:
+            return spec, intervals
+    return None
+
+def partition(rule_table, port_vars=None):
+    # name -> {'protocol', 'ports', 'rules'}; rules sharing a port set share
+    # a group whatever spec they wrote it with
+    groups = {}
+    by_key = {}
+    for r_id, entry in rule_table.items():
+        protocol = entry.get('proto') or 'ip'
+        if protocol not in PROTOCOLS.values():
+            # Snort 3 service rules (http, ...) could be on any protocol
+            protocol = 'ip'
+        key = None
+        if protocol in ('tcp', 'udp'):
+            key = port_key(entry.get('src_port'), entry.get('dst_port'), port_vars)
+        if protocol == 'ip':
+            name, ports = 'any', ANY
+        elif key is None:
+            name, ports = f'{protocol}_any', ANY
+        else:
+            spec, ports = key
+            name = by_key.setdefault((protocol, ports), group_name(protocol, spec))
+        group = groups.setdefault(name, {'protocol': 'any' if protocol == 'ip' else protocol,
+                                         'ports': [list(interval) for interval in ports],
+                                         'rules': []})
+        group['rules'].append(r_id)
+    return groups
+
+class PortGroups:
+    # Group selection for packets, from the groups.json manifest
+    def __init__(self, path=MANIFEST):
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+        self.groups = manifest['groups']
+        self.by_protocol = {}
+        for name, group in self.groups.items():
+            ports = tuple(tuple(interval) for interval in group['ports'])
+            self.by_protocol.setdefault(group['protocol'], []).append(
+                (name, ports, frozenset(group['rules'])))
+        self._cache = {}
+
+    def _selected(self, protocol, src_port, dst_port):
+        if isinstance(protocol, int):
+            protocol = PROTOCOLS.get(protocol, 'ip')
+        for group_protocol in ('any', protocol):
+            for name, ports, rule_ids in self.by_protocol.get(group_protocol, ()):
+                if ports == ANY or in_ports(ports, src_port) or in_ports(ports, dst_port):
+                    yield name, rule_ids
+
+    def select(self, protocol, src_port, dst_port):
+        # Names of the groups a packet with this header is scanned against
+        return [name for name, _ in self._selected(protocol, src_port, dst_port)]
+
+    def rules(self, protocol, src_port, dst_port):
+        # Rule ids a packet with this header can confirm, cached per header
+        key = (protocol, src_port, dst_port)
+        rules = self._cache.get(key)
+        if rules is None:
+            rules = frozenset().union(*(rule_ids for _, rule_ids in
+                                        self._selected(protocol, src_port, dst_port)))
+            self._cache[key] = rules
+        return rules
+
+    def packet_rules(self, five_tuple):
+        # For a 5-tuple of pcapscan's matched_ids.jsonl records
+        return self.rules(five_tuple['protocol'], five_tuple['srcPort'], five_tuple['dstPort'])
@@ -0,0 +1,56 @@
+# header_engine
+#
+# What HDREngine and RuleEngine share: rule headers read from a rule file,
+# the variables they use compiled once, the HeaderIndex over both and a flow
+# cache in front of it. The engines differ only in where packet headers come
+# from (extract_hdr).
+from idstools import rule
+from header_index import FLOW_CACHE_SIZE, PROTOCOL_NUMBERS, FlowCache, HeaderIndex
+from variables import VARS_FILE, load_vars
+
+class HeaderEngine:
+    def __init__(self, rule_file, vars_file=VARS_FILE, flow_cache_size=FLOW_CACHE_SIZE):
+        # Load and preprocess the ruleset
+        self.rules_hdr = self.rule_preprocess(rule_file)
+        # HOME_NET, HTTP_PORTS, ... compiled to interval sets, shared by
+        # every engine loading the same vars file
+        variables = load_vars(vars_file)
+        self.ip_vars = variables.addresses
+        self.port_vars = variables.ports
+        self.header_index = HeaderIndex(self.rules_hdr, self.port_vars, self.ip_vars)
+        self.flow_cache = FlowCache(self.header_index, flow_cache_size)
+
+    def rule_preprocess(self, rule_file):
+        rules_hdr = {}
+        for rul in rule.parse_file(rule_file):
+            rules_hdr[rul.sid] = {
+                'src_ip': rul.source_addr or None,
+                'dst_ip': rul.dest_addr or None,
+                'src_port': rul.source_port or None,
+                'dst_port': rul.dest_port or None,
+                'protocol': rul.proto or None
+            }
+        return rules_hdr
+
+    def header_matching(self, pkt_hdr, rule_ids=None):
+        # A few bisects and ANDs over the compiled header index, done once
+        # per flow direction; rule_ids narrows the result to those rules
+        bits = self.flow_cache.match(pkt_hdr['protocol'], pkt_hdr['src_port'], pkt_hdr['dst_port'],
+                                     pkt_hdr['src_ip'], pkt_hdr['dst_ip'])
+        if rule_ids is not None:
+            bits &= self.header_index.mask(rule_ids)
+
+        matched_rule_ids = set(self.header_index.rules(bits))
+        matched_rules = [{'id': rule_id, **self.rules_hdr[rule_id]} for rule_id in matched_rule_ids]
+        return matched_rule_ids, matched_rules
+
+    def header_matching_batch(self, pkt_hdrs):
+        # Vectorized header_matching for many packets: a packets x rules
+        # boolean matrix whose columns are header_index.sids (needs numpy)
+        matrix = self.header_index.match_batch(
+            [PROTOCOL_NUMBERS.get(pkt_hdr['protocol'], 0) for pkt_hdr in pkt_hdrs],
+            [pkt_hdr['src_port'] for pkt_hdr in pkt_hdrs],
+            [pkt_hdr['dst_port'] for pkt_hdr in pkt_hdrs],
+            [pkt_hdr['src_ip'] for pkt_hdr in pkt_hdrs],
+            [pkt_hdr['dst_ip'] for pkt_hdr in pkt_hdrs])
+        return self.header_index.sids, matrix
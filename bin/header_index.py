@@ -0,0 +1,258 @@
+# header_index
+#
+# Rule headers (protocol, addresses and ports) compiled once into lookup
+# tables, so header matching a packet is a few lookups and ANDs of rule
+# bitsets instead of reparsing every rule's header strings. Shared by
+# HDREngine and RuleEngine.
+#
+# Bit i of every bitset (a Python int) stands for the rule sids[i]. Each
+# port side is cut at every interval boundary any rule uses; a port's
+# bitset is that of the segment it falls in. Each address side is an
+# AddressTrie.
+#
+# match_batch evaluates whole arrays of packets at once with NumPy, the
+# same tables expanded to boolean rows. NumPy is only needed for it.
+import bisect
+from collections import OrderedDict
+try:
+    import numpy as np
+except ImportError:
+    np = None
+from addresses import AddressTrie, parse_addresses
+from addresses import ANY as ANY_ADDRESS
+from ports import ANY, parse_ports
+from variables import load_vars
+
+PROTOCOLS = ('tcp', 'udp', 'icmp')
+PROTOCOL_NUMBERS = {'icmp': 1, 'tcp': 6, 'udp': 17}
+FLOW_CACHE_SIZE = 65536
+
+class IntervalTable:
+    def __init__(self, rule_intervals):
+        # rule_intervals: (bit, intervals) per rule
+        add = {}
+        remove = {}
+        for bit, intervals in rule_intervals:
+            for low, high in intervals:
+                add[low] = add.get(low, 0) | (1 << bit)
+                remove[high + 1] = remove.get(high + 1, 0) | (1 << bit)
+
+        self.starts = sorted(set(add) | set(remove) | {0})
+        self.bits = []
+        running = 0
+        for start in self.starts:
+            running = (running & ~remove.get(start, 0)) | add.get(start, 0)
+            self.bits.append(running)
+
+    def lookup(self, value):
+        return self.bits[bisect.bisect_right(self.starts, value) - 1]
+
+class HeaderIndex:
+    def __init__(self, rules_hdr, port_vars=None, ip_vars=None):
+        # rules_hdr: sid -> {'protocol', 'src_port', 'dst_port', ...} as
+        # built by the engines' rule_preprocess; the variables default to
+        # those of the vars file (variables.VARS_FILE)
+        if port_vars is None:
+            port_vars = load_vars().ports
+        if ip_vars is None:
+            ip_vars = load_vars().addresses
+        self.sids = list(rules_hdr)
+        self.bit_of = {sid: bit for bit, sid in enumerate(self.sids)}
+
+        # 'ip' rules, and Snort 3 service rules whose protocol is only known
+        # at run time, match every protocol
+        self.protocol_bits = dict.fromkeys(PROTOCOLS, 0)
+        wildcard = 0
+        src_ports = []
+        dst_ports = []
+        self.src_addrs = AddressTrie()
+        self.dst_addrs = AddressTrie()
+        # kept for the interval tables match_batch builds
+        self.addr_intervals = ([], [])
+        for bit, sid in enumerate(self.sids):
+            rule_hdr = rules_hdr[sid]
+            protocol = rule_hdr['protocol']
+            if protocol in self.protocol_bits:
+                self.protocol_bits[protocol] |= 1 << bit
+            else:
+                wildcard |= 1 << bit
+            src_ports.append((bit, self._ports(rule_hdr['src_port'], port_vars)))
+            dst_ports.append((bit, self._ports(rule_hdr['dst_port'], port_vars)))
+            for trie, intervals, spec in zip((self.src_addrs, self.dst_addrs), self.addr_intervals,
+                                             (rule_hdr['src_ip'], rule_hdr['dst_ip'])):
+                addresses = self._addresses(spec, ip_vars)
+                trie.add(addresses, 1 << bit)
+                intervals.append((bit, addresses))
+        for protocol in PROTOCOLS:
+            self.protocol_bits[protocol] |= wildcard
+        self.wildcard = wildcard
+
+        self.src_table = IntervalTable(src_ports)
+        self.dst_table = IntervalTable(dst_ports)
+        self._batch = None
+
+    @staticmethod
+    def _ports(spec, port_vars):
+        # A rule whose port spec cannot be resolved is kept for every port
+        if not spec:
+            return ANY
+        try:
+            return parse_ports(spec, port_vars)
+        except ValueError:
+            return ANY
+
+    @staticmethod
+    def _addresses(spec, ip_vars):
+        # Likewise for address specs, including IPv6 ones
+        if not spec:
+            return ANY_ADDRESS
+        try:
+            return parse_addresses(spec, ip_vars)
+        except ValueError:
+            return ANY_ADDRESS
+
+    def match(self, protocol, src_port, dst_port, src_addr=None, dst_addr=None):
+        # Bitset of the rules whose header accepts the packet; addresses are
+        # integers and are not checked when None
+        bits = (self.protocol_bits.get(protocol, self.wildcard)
+                & self.src_table.lookup(src_port)
+                & self.dst_table.lookup(dst_port))
+        if bits and src_addr is not None:
+            bits &= self.src_addrs.lookup(src_addr)
+        if bits and dst_addr is not None:
+            bits &= self.dst_addrs.lookup(dst_addr)
+        return bits
+
+    def _row(self, bits):
+        # Bitset as a boolean row over sids
+        raw = np.frombuffer(bits.to_bytes((len(self.sids) + 7) // 8, 'little'), dtype=np.uint8)
+        return np.unpackbits(raw, bitorder='little')[:len(self.sids)].astype(bool)
+
+    def _batch_tables(self):
+        if np is None:
+            raise ImportError("match_batch needs numpy")
+        if self._batch is None:
+            def rows(table):
+                return (np.array(table.starts, dtype=np.int64),
+                        np.stack([self._row(bits) for bits in table.bits]))
+
+            # protocol number -> row; row 0 is the wildcard row for
+            # protocols no rule names
+            protocol_row = np.zeros(256, dtype=np.intp)
+            protocol_rows = [self._row(self.wildcard)]
+            for name, number in PROTOCOL_NUMBERS.items():
+                protocol_row[number] = len(protocol_rows)
+                protocol_rows.append(self._row(self.protocol_bits[name]))
+            src_addrs, dst_addrs = self.addr_intervals
+            self._batch = {
+                'protocol': (protocol_row, np.stack(protocol_rows)),
+                'src_port': rows(self.src_table),
+                'dst_port': rows(self.dst_table),
+                'src_addr': rows(IntervalTable(src_addrs)),
+                'dst_addr': rows(IntervalTable(dst_addrs)),
+            }
+        return self._batch
+
+    def match_batch(self, protocols, src_ports, dst_ports, src_addrs=None, dst_addrs=None):
+        # packets x rules boolean matrix, columns in sids order, for arrays
+        # of IP protocol numbers, ports and integer addresses. As in match,
+        # a None address (an IPv6 packet's) is not checked, for the whole
+        # array or a single packet. Memory is packets * rules bytes, so
+        # chunk large captures.
+        tables = self._batch_tables()
+        protocol_row, protocol_rows = tables['protocol']
+        matrix = protocol_rows[protocol_row[np.asarray(protocols, dtype=np.intp)]]
+        for name, values in (('src_port', src_ports), ('dst_port', dst_ports),
+                             ('src_addr', src_addrs), ('dst_addr', dst_addrs)):
+            if values is None:
+                continue
+            values, known = self._column(values)
+            starts, rows = tables[name]
+            segments = np.searchsorted(starts, values, side='right') - 1
+            if known is None:
+                matrix &= rows[segments]
+            else:
+                matrix &= rows[segments] | ~known[:, None]
+        return matrix
+
+    @staticmethod
+    def _column(values):
+        # values as int64, and which of them are not None (None when all are)
+        try:
+            return np.asarray(values, dtype=np.int64), None
+        except TypeError:
+            pass
+        known = np.fromiter((value is not None for value in values), dtype=bool, count=len(values))
+        values = np.fromiter((0 if value is None else value for value in values),
+                             dtype=np.int64, count=len(values))
+        return values, known
+
+    def mask(self, sids):
+        bits = 0
+        bit_of = self.bit_of
+        for sid in sids:
+            bit = bit_of.get(sid)
+            if bit is not None:
+                bits |= 1 << bit
+        return bits
+
+    def rule_bits(self, ruleset):
+        # Bit of each rule id of a compiled ruleset (string_gen's r_ids,
+        # mapped through their sids), -1 for rules without a header here
+        bit_of = self.bit_of
+        return [bit_of.get(ruleset.sid(rule_id), -1) for rule_id in range(ruleset.num_rules)]
+
+    def rules(self, bits):
+        # sids of the set bits
+        sids = []
+        while bits:
+            low = bits & -bits
+            sids.append(self.sids[low.bit_length() - 1])
+            bits ^= low
+        return sids
+
+def flow_key(protocol, src_addr, src_port, dst_addr, dst_port):
+    # Both directions of a flow share the normalized tuple (lower endpoint
+    # first); the direction tells them apart, since rule headers are not
+    # symmetric
+    src = (src_addr, src_port)
+    dst = (dst_addr, dst_port)
+    if src <= dst:
+        return protocol, src, dst, 0
+    return protocol, dst, src, 1
+
+class FlowCache:
+    # Bounded LRU of HeaderIndex.match results per flow and direction, so
+    # only the first packet each way of a flow pays for the lookups
+    def __init__(self, index, size=FLOW_CACHE_SIZE):
+        self.index = index
+        self.size = size
+        self.flows = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def match(self, protocol, src_port, dst_port, src_addr=None, dst_addr=None):
+        key = flow_key(protocol, src_addr, src_port, dst_addr, dst_port)
+        bits = self.flows.get(key)
+        if bits is not None:
+            self.flows.move_to_end(key)
+            self.hits += 1
+            return bits
+        self.misses += 1
+        bits = self.index.match(protocol, src_port, dst_port, src_addr, dst_addr)
+        self.flows[key] = bits
+        if len(self.flows) > self.size:
+            self.flows.popitem(last=False)
+            self.evictions += 1
+        return bits
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'flows': len(self.flows),
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
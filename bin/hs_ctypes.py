@@ -0,0 +1,226 @@
+# hs_ctypes
+#
+# Minimal ctypes bindings over libhs (built from this tree) for scanning
+# from Python: compile a literals.txt the way pcapscan does and block-scan
+# buffers for the ids they match. The library is looked up through
+# $HS_LIBRARY, the tree's build directories, then the system paths.
+#
+# pcapscan links libhs statically; the shared library next to it comes
+# from configuring with BUILD_STATIC_AND_SHARED, as run.sh does, and is
+# built as lib/libhs.so:
+#   cmake -DBUILD_STATIC_AND_SHARED=ON . && make
+import ctypes
+import ctypes.util
+import os
+import re
+from ruleset import HS_FLAG_PREFILTER, flag_bits
+
+HS_SUCCESS = 0
+HS_MODE_BLOCK = 1
+HS_FLAG_ALLOWEMPTY = 16
+HS_EXT_FLAG_MIN_OFFSET = 1
+HS_EXT_FLAG_MAX_OFFSET = 2
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+LIBRARY_PATHS = ('lib/libhs.so', 'build/lib/libhs.so', 'lib/libhs.dylib', 'build/lib/libhs.dylib')
+
+class CompileError(ctypes.Structure):
+    _fields_ = [('message', ctypes.c_char_p), ('expression', ctypes.c_int)]
+
+class ExprExt(ctypes.Structure):
+    _fields_ = [('flags', ctypes.c_ulonglong),
+                ('min_offset', ctypes.c_ulonglong),
+                ('max_offset', ctypes.c_ulonglong),
+                ('min_length', ctypes.c_ulonglong),
+                ('edit_distance', ctypes.c_uint),
+                ('hamming_distance', ctypes.c_uint)]
+
+MATCH_HANDLER = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_uint, ctypes.c_ulonglong,
+                                 ctypes.c_ulonglong, ctypes.c_uint, ctypes.c_void_p)
+
+class HyperscanError(RuntimeError):
+    pass
+
+_library = None
+
+def load_library(path=None):
+    global _library
+    if _library is not None and path is None:
+        return _library
+    candidates = [path or os.environ.get('HS_LIBRARY')]
+    candidates += [os.path.join(ROOT, relative) for relative in LIBRARY_PATHS]
+    candidates.append(ctypes.util.find_library('hs'))
+    library = None
+    for candidate in candidates:
+        if not candidate or (os.sep in candidate and not os.path.exists(candidate)):
+            continue
+        try:
+            library = ctypes.CDLL(candidate)
+            break
+        except OSError:
+            continue
+    if library is None:
+        raise OSError("libhs not found: configure this tree with "
+                      "'cmake -DBUILD_STATIC_AND_SHARED=ON .' and make (as run.sh does), "
+                      "or point $HS_LIBRARY at libhs.so")
+
+    pointer = ctypes.c_void_p
+    library.hs_compile_lit_multi.argtypes = [
+        ctypes.POINTER(ctypes.c_char_p), ctypes.POINTER(ctypes.c_uint), ctypes.POINTER(ctypes.c_uint),
+        ctypes.POINTER(ctypes.c_size_t), ctypes.c_uint, ctypes.c_uint, pointer,
+        ctypes.POINTER(pointer), ctypes.POINTER(ctypes.POINTER(CompileError))]
+    library.hs_compile_ext_multi.argtypes = [
+        ctypes.POINTER(ctypes.c_char_p), ctypes.POINTER(ctypes.c_uint), ctypes.POINTER(ctypes.c_uint),
+        ctypes.POINTER(ctypes.POINTER(ExprExt)), ctypes.c_uint, ctypes.c_uint, pointer,
+        ctypes.POINTER(pointer), ctypes.POINTER(ctypes.POINTER(CompileError))]
+    library.hs_free_compile_error.argtypes = [ctypes.POINTER(CompileError)]
+    library.hs_free_database.argtypes = [pointer]
+    library.hs_alloc_scratch.argtypes = [pointer, ctypes.POINTER(pointer)]
+    library.hs_clone_scratch.argtypes = [pointer, ctypes.POINTER(pointer)]
+    library.hs_free_scratch.argtypes = [pointer]
+    library.hs_scan.argtypes = [pointer, ctypes.c_void_p, ctypes.c_uint, ctypes.c_uint, pointer,
+                                MATCH_HANDLER, pointer]
+    for name in ('hs_compile_lit_multi', 'hs_compile_ext_multi', 'hs_free_compile_error',
+                 'hs_free_database', 'hs_alloc_scratch', 'hs_clone_scratch', 'hs_free_scratch',
+                 'hs_scan'):
+        getattr(library, name).restype = ctypes.c_int
+    if path is None:
+        _library = library
+    return library
+
+def unescape(pattern):
+    # pcapscan's parseEscapedString: \xNN escapes to the bytes they stand for
+    return re.sub(rb'\\x([0-9A-Fa-f]{2})', lambda m: bytes([int(m.group(1), 16)]), pattern)
+
+def escape_literal(literal):
+    # Literal bytes as a regex matching exactly them
+    return b''.join(b'\\x%02x' % byte for byte in literal)
+
+def read_patterns(path):
+    # (id, expression, HS flags, min_offset, max_offset or None) per line of
+    # literals.txt: id[,flags[,min_offset,max_offset]]:pattern
+    patterns = []
+    with open(path, 'rb') as f:
+        for line in f:
+            line = line.rstrip(b'\r\n')
+            if not line or line.startswith(b'#'):
+                continue
+            header, _, pattern = line.partition(b':')
+            fields = header.decode().split(',')
+            flags = flag_bits(fields[1]) if len(fields) > 1 else 0
+            min_offset = int(fields[2]) if len(fields) > 2 and fields[2] else 0
+            max_offset = int(fields[3]) if len(fields) > 3 and fields[3] else None
+            expression = pattern if flags & HS_FLAG_PREFILTER else unescape(pattern)
+            patterns.append((int(fields[0]), expression, flags, min_offset, max_offset))
+    return patterns
+
+class Database:
+    # A block mode database, compiled as pcapscan's buildDatabase does
+    def __init__(self, patterns, library=None):
+        self.lib = library or load_library()
+        self.db = ctypes.c_void_p()
+        count = len(patterns)
+        ids = (ctypes.c_uint * count)(*(pattern[0] for pattern in patterns))
+        flags = (ctypes.c_uint * count)(*(pattern[2] for pattern in patterns))
+        error = ctypes.POINTER(CompileError)()
+
+        if all(not flag & HS_FLAG_PREFILTER and not min_offset and max_offset is None
+               for _, _, flag, min_offset, max_offset in patterns):
+            expressions = (ctypes.c_char_p * count)(*(pattern[1] for pattern in patterns))
+            lens = (ctypes.c_size_t * count)(*(len(pattern[1]) for pattern in patterns))
+            err = self.lib.hs_compile_lit_multi(expressions, flags, ids, lens, count, HS_MODE_BLOCK,
+                                                None, ctypes.byref(self.db), ctypes.byref(error))
+            if err != HS_SUCCESS:
+                self._raise(error, patterns)
+            return
+
+        # Offset bounds and pcres need the regex compiler; literals become
+        # runs of \xNN escapes
+        expressions = (ctypes.c_char_p * count)(*(
+            expression if flag & HS_FLAG_PREFILTER else escape_literal(expression)
+            for _, expression, flag, _, _ in patterns))
+        exts = [ExprExt() for _ in patterns]
+        for ext, (_, _, _, min_offset, max_offset) in zip(exts, patterns):
+            if min_offset:
+                ext.flags |= HS_EXT_FLAG_MIN_OFFSET
+                ext.min_offset = min_offset
+            if max_offset is not None:
+                ext.flags |= HS_EXT_FLAG_MAX_OFFSET
+                ext.max_offset = max_offset
+        ext_pointers = (ctypes.POINTER(ExprExt) * count)(*(ctypes.pointer(ext) for ext in exts))
+        while True:
+            err = self.lib.hs_compile_ext_multi(expressions, flags, ids, ext_pointers, count,
+                                                HS_MODE_BLOCK, None, ctypes.byref(self.db),
+                                                ctypes.byref(error))
+            if err == HS_SUCCESS:
+                return
+            bad = error.contents.expression
+            if bad < 0 or not flags[bad] & HS_FLAG_PREFILTER:
+                self._raise(error, patterns)
+            # As in pcapscan, a pcre even prefilter mode rejects still has to
+            # report its id, so it becomes an empty pattern matching every
+            # buffer
+            self.lib.hs_free_compile_error(error)
+            expressions[bad] = b''
+            flags[bad] = HS_FLAG_ALLOWEMPTY
+
+    def _raise(self, error, patterns):
+        bad = error.contents.expression
+        message = error.contents.message.decode(errors='replace')
+        self.lib.hs_free_compile_error(error)
+        if bad >= 0:
+            message = f"pattern {patterns[bad][0]} ({patterns[bad][1]!r}): {message}"
+        raise HyperscanError(message)
+
+    @classmethod
+    def from_file(cls, path, library=None):
+        return cls(read_patterns(path), library)
+
+    def scanner(self):
+        return Scanner(self)
+
+    def close(self):
+        if self.db:
+            self.lib.hs_free_database(self.db)
+            self.db = ctypes.c_void_p()
+
+class Scanner:
+    # Scratch space of one thread and a reusable match callback
+    def __init__(self, database):
+        self.database = database
+        self.lib = database.lib
+        self.scratch = ctypes.c_void_p()
+        if self.lib.hs_alloc_scratch(database.db, ctypes.byref(self.scratch)) != HS_SUCCESS:
+            raise HyperscanError("could not allocate scratch")
+        self.matches = set()
+
+        add = self.matches.add
+        def on_match(pattern_id, start, end, flags, context):
+            add(pattern_id)
+            return 0
+        self.handler = MATCH_HANDLER(on_match)
+
+    def scan(self, data):
+        # Sorted ids of the patterns matching data (bytes or a buffer, as
+        # pcap_reader's memoryviews; writable buffers are passed without a
+        # copy)
+        self.matches.clear()
+        length = len(data)
+        if not length:
+            return []
+        if isinstance(data, bytes):
+            buffer = data
+        else:
+            try:
+                buffer = (ctypes.c_char * length).from_buffer(data)
+            except TypeError:
+                buffer = bytes(data)
+        err = self.lib.hs_scan(self.database.db, buffer, length, 0, self.scratch, self.handler, None)
+        if err != HS_SUCCESS:
+            raise HyperscanError(f"hs_scan failed with error {err}")
+        return sorted(self.matches)
+
+    def close(self):
+        if self.scratch:
+            self.lib.hs_free_scratch(self.scratch)
+            self.scratch = ctypes.c_void_p()
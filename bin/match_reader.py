@@ -0,0 +1,100 @@
+# match_reader
+#
+# Streams pcapscan's per-packet match lists as (packet id, [str_id, ...]) so a
+# capture never has to fit in memory. Two formats are read:
+#
+#   matched_ids.jsonl  one JSON array per line, what pcapscan writes:
+#                      [packet_id, [str_id, ...], five_tuple], five_tuple
+#                      {"protocol", "srcAddr", "srcPort", "dstAddr",
+#                      "dstPort"} (absent in older files)
+#   matched_ids.json   the older single {"packet_id": [str_id, ...], ...}
+#                      object, decoded incrementally
+#
+# iter_packets also yields each packet's 5-tuple, from its record or, for
+# older files, from the five_tuples.json object pcapscan used to write next
+# to them, decoded incrementally alongside.
+import itertools
+import json
+
+CHUNK_SIZE = 1 << 16
+
+def iter_matches(path):
+    for pkt, str_ids, _ in _iter_records(path):
+        yield pkt, str_ids
+
+def iter_packets(path, tuples_path=None):
+    # (packet id, [str_id, ...], five_tuple or None)
+    records = _iter_records(path)
+    if tuples_path is None:
+        yield from records
+        return
+    five_tuples = _iter_json(tuples_path)
+    next_tuple = next(five_tuples, None)
+    for pkt, str_ids, five_tuple in records:
+        # both list packets in capture order; a packet missing from the
+        # tuples is passed over
+        while next_tuple is not None and int(next_tuple[0]) < int(pkt):
+            next_tuple = next(five_tuples, None)
+        if five_tuple is None and next_tuple is not None and int(next_tuple[0]) == int(pkt):
+            five_tuple = next_tuple[1]
+        yield pkt, str_ids, five_tuple
+
+def _iter_records(path):
+    for record in _iter_json(path):
+        yield record if len(record) == 3 else (*record, None)
+
+def _iter_json(path):
+    with open(path, 'r') as match_file:
+        first = match_file.read(1)
+        while first.isspace():
+            first = match_file.read(1)
+        if first == '{':
+            yield from _iter_object(match_file)
+        elif first:
+            yield from _iter_lines(first + match_file.readline(), match_file)
+
+def _iter_lines(first_line, match_file):
+    for line in itertools.chain([first_line], match_file):
+        line = line.strip()
+        if line:
+            yield tuple(json.loads(line))
+
+def _iter_object(match_file):
+    # Entries are decoded one at a time out of a rolling buffer; the opening
+    # '{' has already been consumed
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    while True:
+        # Skip separators up to the next key or the closing brace
+        while True:
+            while pos < len(buf) and (buf[pos].isspace() or buf[pos] == ','):
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            buf, pos = match_file.read(CHUNK_SIZE), 0
+            eof = not buf
+        if pos >= len(buf) or buf[pos] == '}':
+            return
+
+        try:
+            key, end = decoder.raw_decode(buf, pos)
+            colon = buf.index(':', end)
+            value, end = decoder.raw_decode(buf, colon + 1 + _skip_space(buf, colon + 1))
+        except (json.JSONDecodeError, ValueError):
+            # The entry straddles the end of the buffer
+            if eof:
+                raise ValueError(f"truncated JSON object in {match_file.name}")
+            chunk = match_file.read(CHUNK_SIZE)
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+        yield key, value
+        pos = end
+
+def _skip_space(buf, pos):
+    n = 0
+    while pos + n < len(buf) and buf[pos + n].isspace():
+        n += 1
+    return n
@@ -0,0 +1,234 @@
+# pcap_reader
+#
+# pcap and pcapng reader without scapy. The capture is mmapped and every
+# packet comes out as a memoryview slice of the map, so nothing is copied
+# and large captures stream at page-cache speed in constant memory. The
+# 5-tuple is unpacked straight from those bytes with struct. Handles
+# Ethernet (with 802.1Q / 802.1ad VLAN tags), Linux cooked and raw IP
+# captures, IPv4 and IPv6 (skipping extension headers).
+import mmap
+import os
+import struct
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+
+ETHERTYPE_IP = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+VLAN_TYPES = (0x8100, 0x88a8, 0x9100)
+
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+IPPROTO_SCTP = 132
+PORT_PROTOCOLS = (IPPROTO_TCP, IPPROTO_UDP, IPPROTO_SCTP)
+IPV6_FRAGMENT = 44
+IPV6_EXTENSIONS = (0, 43, 60, IPV6_FRAGMENT)
+
+# pcap magic -> (byte order, seconds per timestamp fraction unit)
+MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e-6),
+    b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e-9),
+    b'\xa1\xb2\x3c\x4d': ('>', 1e-9),
+}
+
+# pcapng block types
+SECTION_HEADER = 0x0a0d0d0a
+INTERFACE_DESCRIPTION = 1
+OBSOLETE_PACKET = 2
+SIMPLE_PACKET = 3
+ENHANCED_PACKET = 6
+BYTE_ORDER_MAGIC = b'\x4d\x3c\x2b\x1a'
+IF_TSRESOL = 9
+
+class PcapFile:
+    # Iterates (timestamp, linktype, data) per packet of a pcap or pcapng
+    # capture. data is a memoryview into the map: callers keeping it past
+    # close() should copy it with bytes().
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            # a private mapping: nothing is written back, and the views are
+            # writable buffers ctypes can hand to C (hs_ctypes) without a copy
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY) if size else None
+        self.view = memoryview(self.map if self.map is not None else b'')
+        magic = bytes(self.view[:4])
+        if len(self.view) >= 24 and magic in MAGIC:
+            self.records = self._pcap_records
+        elif len(self.view) >= 28 and struct.unpack_from('<I', magic)[0] == SECTION_HEADER:
+            self.records = self._pcapng_records
+        else:
+            self.close()
+            raise ValueError(f"{path}: not a pcap or pcapng file")
+
+    def __iter__(self):
+        return self.records()
+
+    def _pcap_records(self):
+        view = self.view
+        byte_order, resolution = MAGIC[bytes(view[:4])]
+        # the top bits may carry FCS information
+        linktype = struct.unpack_from(byte_order + 'I', view, 20)[0] & 0x0fffffff
+        record = struct.Struct(byte_order + 'IIII')
+        offset = 24
+        end = len(view)
+        while offset + record.size <= end:
+            seconds, fraction, captured, _ = record.unpack_from(view, offset)
+            offset += record.size
+            if offset + captured > end:
+                # truncated capture
+                return
+            yield seconds + fraction * resolution, linktype, view[offset:offset + captured]
+            offset += captured
+
+    def _pcapng_records(self):
+        view = self.view
+        end = len(view)
+        offset = 0
+        byte_order = '<'
+        interfaces = []
+        while offset + 12 <= end:
+            block_type, = struct.unpack_from(byte_order + 'I', view, offset)
+            if block_type == SECTION_HEADER:
+                # each section sets its own byte order and interfaces
+                byte_order = '<' if bytes(view[offset + 8:offset + 12]) == BYTE_ORDER_MAGIC else '>'
+                interfaces = []
+            length, = struct.unpack_from(byte_order + 'I', view, offset + 4)
+            if length < 12 or offset + length > end:
+                return
+            body = offset + 8
+            packet = None
+            if block_type == INTERFACE_DESCRIPTION:
+                linktype, = struct.unpack_from(byte_order + 'H', view, body)
+                interfaces.append((linktype, self._resolution(view, body + 8, offset + length - 4,
+                                                              byte_order)))
+            elif block_type in (ENHANCED_PACKET, OBSOLETE_PACKET):
+                layout = 'IIIII' if block_type == ENHANCED_PACKET else 'HHIIII'
+                fields = struct.unpack_from(byte_order + layout, view, body)
+                interface, high, low, captured = fields[0], fields[-4], fields[-3], fields[-2]
+                packet = interface, (high << 32) | low, body + 20, captured
+            elif block_type == SIMPLE_PACKET:
+                original, = struct.unpack_from(byte_order + 'I', view, body)
+                packet = 0, None, body + 4, min(original, length - 16)
+            if packet is not None and packet[0] < len(interfaces):
+                interface, timestamp, start, captured = packet
+                linktype, resolution = interfaces[interface]
+                timestamp = 0.0 if timestamp is None else timestamp * resolution
+                yield timestamp, linktype, view[start:start + captured]
+            offset += length
+
+    @staticmethod
+    def _resolution(view, offset, end, byte_order):
+        # if_tsresol of an interface description block, microseconds if absent
+        while offset + 4 <= end:
+            code, length = struct.unpack_from(byte_order + 'HH', view, offset)
+            if code == 0:
+                break
+            if code == IF_TSRESOL and length >= 1:
+                value = view[offset + 4]
+                return 2.0 ** -(value & 0x7f) if value & 0x80 else 10.0 ** -value
+            offset += 4 + (length + 3) // 4 * 4
+        return 1e-6
+
+    def close(self):
+        self.view.release()
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                # packet views are still referenced; the map is unmapped
+                # once they go
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def network_layer(data, linktype):
+    # (ethertype, offset) of the IP header, None for other link types
+    if linktype == LINKTYPE_ETHERNET:
+        if len(data) < 14:
+            return None
+        ethertype, = struct.unpack_from('!H', data, 12)
+        offset = 14
+        while ethertype in VLAN_TYPES and len(data) >= offset + 4:
+            ethertype, = struct.unpack_from('!H', data, offset + 2)
+            offset += 4
+        return ethertype, offset
+    if linktype == LINKTYPE_LINUX_SLL:
+        if len(data) < 16:
+            return None
+        return struct.unpack_from('!H', data, 14)[0], 16
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        if not data:
+            return None
+        return (ETHERTYPE_IPV6 if data[0] >> 4 == 6 else ETHERTYPE_IP), 0
+    return None
+
+def decode(data, linktype=LINKTYPE_ETHERNET):
+    # (five_tuple, payload) of a packet, None for non-IP packets. The
+    # five_tuple is (protocol, src_addr, src_port, dst_addr, dst_port,
+    # ip_version) with integer addresses in host order; ports are 0 for
+    # protocols without them and for non-first fragments. payload is the
+    # slice of data after the transport header (after the IP header for
+    # other protocols and fragments), without link-layer padding.
+    layer = network_layer(data, linktype)
+    if layer is None:
+        return None
+    ethertype, offset = layer
+    fragment = 0
+    if ethertype == ETHERTYPE_IP:
+        if len(data) < offset + 20:
+            return None
+        version = 4
+        transport = offset + (data[offset] & 0x0f) * 4
+        end = offset + struct.unpack_from('!H', data, offset + 2)[0]
+        protocol = data[offset + 9]
+        fragment = struct.unpack_from('!H', data, offset + 6)[0] & 0x1fff
+        src_addr, dst_addr = struct.unpack_from('!II', data, offset + 12)
+    elif ethertype == ETHERTYPE_IPV6:
+        if len(data) < offset + 40:
+            return None
+        version = 6
+        end = offset + 40 + struct.unpack_from('!H', data, offset + 4)[0]
+        protocol = data[offset + 6]
+        src_addr = int.from_bytes(data[offset + 8:offset + 24], 'big')
+        dst_addr = int.from_bytes(data[offset + 24:offset + 40], 'big')
+        transport = offset + 40
+        while protocol in IPV6_EXTENSIONS and len(data) >= transport + 8:
+            if protocol == IPV6_FRAGMENT:
+                fragment = struct.unpack_from('!H', data, transport + 2)[0] >> 3
+                length = 8
+            else:
+                length = (data[transport + 1] + 1) * 8
+            protocol = data[transport]
+            transport += length
+    else:
+        return None
+
+    src_port = dst_port = 0
+    start = transport
+    if protocol in PORT_PROTOCOLS and not fragment and len(data) >= transport + 4:
+        src_port, dst_port = struct.unpack_from('!HH', data, transport)
+        if protocol == IPPROTO_TCP and len(data) >= transport + 13:
+            start = transport + (data[transport + 12] >> 4) * 4
+        elif protocol == IPPROTO_UDP:
+            start = transport + 8
+    end = min(end, len(data))
+    return (protocol, src_addr, src_port, dst_addr, dst_port, version), data[min(start, end):end]
+
+def five_tuple(data, linktype=LINKTYPE_ETHERNET):
+    # The five_tuple part of decode
+    decoded = decode(data, linktype)
+    return decoded[0] if decoded else None
+
+def five_tuples(path):
+    # five_tuple of every record of a capture, None for non-IP ones
+    with PcapFile(path) as pcap:
+        for _, linktype, data in pcap:
+            yield five_tuple(data, linktype)
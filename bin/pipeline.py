@@ -0,0 +1,192 @@
+# pipeline
+#
+# pcapscan, rule_filter and the header engine in one process, as streaming
+# generator stages over packet batches with no intermediate JSON:
+#
+#   read    pcap_reader: each TCP/UDP packet with a payload, the payload a
+#           view into the mmapped capture
+#   scan    hs_ctypes over literals.txt: the str ids each payload matches
+#   filter  rule_filter's stages: the packet's port groups with --groups,
+#           then content confirmation (bloom, exact or counter) and the rule
+#           engine's header index, in the order --order gives
+#
+# read and scan run in a thread (hs_scan releases the GIL) handing batches
+# over a bounded queue, so they never get more than --queue-depth batches
+# ahead of filtering; every other stage only pulls what it needs. Each
+# stage's wall and CPU time and every packet's latency from read to the end
+# of filtering go to a metrics.Metrics, exported with --metrics.
+import argparse
+import queue
+import threading
+import time
+from groups import PortGroups
+from hdr_match import PROTOCOL_NAMES, RuleEngine
+from hs_ctypes import Database, load_library
+from metrics import EXPORT_FORMATS, Metrics
+from pcap_reader import PcapFile, decode
+from rule_filter import (FILTER_MODES, STAGE_ORDERS, FilterStats, filter_rules,
+                         make_header_stage, make_stages)
+from ruleset import Ruleset
+from variables import VARS_FILE
+
+class Packet:
+    __slots__ = ('pkt', 'five_tuple', 'payload', 'read_time', 'str_ids',
+                 'candidate_rules', 'rules')
+
+    def __init__(self, pkt, five_tuple, payload, read_time):
+        self.pkt = pkt
+        self.five_tuple = five_tuple
+        self.payload = payload
+        self.read_time = read_time
+        self.str_ids = ()
+        self.candidate_rules = ()
+        self.rules = ()
+
+def read_packets(pcap_path, batch_size, metrics):
+    # Packets are numbered in capture order among those scanned
+    with PcapFile(pcap_path) as pcap:
+        batch = []
+        pkt = 0
+        started = metrics.start()
+        for _, linktype, data in pcap:
+            decoded = decode(data, linktype)
+            if decoded is None:
+                continue
+            five_tuple, payload = decoded
+            if five_tuple[0] not in PROTOCOL_NAMES or not payload:
+                continue
+            batch.append(Packet(pkt, five_tuple, payload, time.perf_counter()))
+            pkt += 1
+            if len(batch) == batch_size:
+                metrics.stop('read', started)
+                yield batch
+                batch = []
+                started = metrics.start()
+        metrics.stop('read', started)
+        if batch:
+            yield batch
+
+def scan_stage(batches, scanner, metrics):
+    for batch in batches:
+        for packet in batch:
+            started = metrics.start()
+            packet.str_ids = scanner.scan(packet.payload)
+            metrics.stop('scan', started)
+        yield batch
+
+def filter_stage(batches, ruleset, stages, stats, groups=None, prune=None, order='content'):
+    for batch in batches:
+        for packet in batch:
+            protocol, src_addr, src_port, dst_addr, dst_port, version = packet.five_tuple
+            allowed = groups.rules(protocol, src_port, dst_port) if groups is not None else None
+            header = None
+            if prune is not None:
+                if version != 4:
+                    src_addr = dst_addr = None
+                header = lambda rule_ids: prune(rule_ids, protocol, src_port, dst_port,
+                                                src_addr, dst_addr)
+            packet.candidate_rules, packet.rules = filter_rules(
+                ruleset, stages, packet.str_ids, stats, allowed, header, order)
+        yield batch
+
+def prefetch(batches, depth):
+    # Runs the batches generator in a thread, at most depth batches ahead
+    handoff = queue.Queue(maxsize=depth)
+    done = object()
+
+    def produce():
+        try:
+            for batch in batches:
+                handoff.put(batch)
+        except BaseException as error:
+            handoff.put(error)
+        handoff.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        batch = handoff.get()
+        if batch is done:
+            return
+        if isinstance(batch, BaseException):
+            raise batch
+        yield batch
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Scan a capture and confirm rules in one process')
+    parser.add_argument('pcap', help='pcap or pcapng capture')
+    parser.add_argument('--literals', default='literals.txt', help="string_gen's literals file")
+    parser.add_argument('--ruleset', default='ruleset.bin', help="string_gen's ruleset")
+    parser.add_argument('--mode', choices=FILTER_MODES, default='bloom',
+                        help='rule confirmation, as for rule_filter')
+    parser.add_argument('--groups', metavar='MANIFEST',
+                        help="string_gen's groups.json: only confirm rules of the port groups "
+                             "each packet's 5-tuple selects")
+    parser.add_argument('--rules', default='snort3-community.rules',
+                        help='rule file the header stage reads headers from')
+    parser.add_argument('--vars', default=VARS_FILE, help='variables file for the header stage')
+    parser.add_argument('--no-header', action='store_true', help='skip the header stage')
+    parser.add_argument('--order', choices=STAGE_ORDERS, default='content',
+                        help='confirm content before matching headers, or the other way round')
+    parser.add_argument('--batch-size', type=int, default=256, help='packets per batch')
+    parser.add_argument('--queue-depth', type=int, default=4,
+                        help='scanned batches allowed to wait for the filter stage')
+    parser.add_argument('--hs-library', help='libhs shared library (default: $HS_LIBRARY or the build tree)')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help="write per-stage times, rates and latency percentiles to PATH ('-' for stdout)")
+    parser.add_argument('--metrics-format', choices=EXPORT_FORMATS, default='json',
+                        help='format of the --metrics output')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    metrics = Metrics('pipeline')
+    with metrics.stage('load'):
+        ruleset = Ruleset(args.ruleset)
+        groups = PortGroups(args.groups) if args.groups else None
+    with metrics.stage('build'):
+        stages = make_stages(args.mode, ruleset)
+    with metrics.stage('header_load'):
+        engine = None if args.no_header else RuleEngine(args.rules, args.vars)
+        prune = make_header_stage(ruleset, engine) if engine is not None else None
+    with metrics.stage('compile'):
+        library = load_library(args.hs_library) if args.hs_library else None
+        database = Database.from_file(args.literals, library)
+        scanner = database.scanner()
+
+    batches = read_packets(args.pcap, args.batch_size, metrics)
+    batches = prefetch(scan_stage(batches, scanner, metrics), args.queue_depth)
+    stats = FilterStats(metrics)
+    batches = filter_stage(batches, ruleset, stages, stats, groups, prune, args.order)
+
+    started = metrics.start()
+    for batch in batches:
+        now = time.perf_counter()
+        for packet in batch:
+            metrics.observe('end_to_end_latency_seconds', now - packet.read_time)
+    elapsed = metrics.stop('run', started)
+    scanner.close()
+    database.close()
+
+    latency = metrics.summary()['histograms'].get('end_to_end_latency_seconds', {})
+    print(f'packets: {stats.num_packets} in {elapsed:.3f}s '
+          f'({stats.num_packets / elapsed if elapsed else 0:.0f} packets/s)')
+    print(f'latency per packet: p50 {latency.get("p50", 0):.6f}s, p99 {latency.get("p99", 0):.6f}s, '
+          f'p999 {latency.get("p999", 0):.6f}s, max {latency.get("max", 0):.6f}s')
+    print(f'number of non filtered rules: {len(stats.non_fitered_ids)}')
+    print(f'Number of filtered rules: {len(stats.filtered_ids)}')
+    print(f'Average number of rules matched: {stats.count/stats.num_packets if stats.num_packets else 0}')
+    print(f'Maximum number of rules matched: {stats.max}')
+    order = ['header', 'content'] if args.order == 'header' else ['content', 'header']
+    if engine is None:
+        order.remove('header')
+    print('\nrules eliminated per stage')
+    for stage in ['groups'] + order:
+        print(f'{stage}: {stats.eliminated[stage]}')
+    if engine is not None:
+        print(f'flow cache: {engine.flow_cache.stats()}')
+
+    if args.metrics:
+        metrics.export(args.metrics, args.metrics_format, elapsed)
+
+if __name__ == "__main__":
+    main()
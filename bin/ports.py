@@ -0,0 +1,122 @@
+# ports
+#
+# Snort port specs compiled to sorted, disjoint, inclusive (low, high)
+# intervals:
+#
+#   any  80  1024:  :1023  !21  [80,8080,1024:2048,!1500]  $HTTP_PORTS
+#
+# A list is the union of its items less its negated ones (less them from
+# 'any' when it has only negated ones). Variables resolve through a
+# name -> spec (or compiled intervals) dict, as variables.load_vars
+# builds from the vars file; without one a variable is undefined.
+import bisect
+
+MAX_PORT = 65535
+ANY = ((0, MAX_PORT),)
+
+def normalize(intervals):
+    merged = []
+    for low, high in sorted(intervals):
+        if merged and low <= merged[-1][1] + 1:
+            if high > merged[-1][1]:
+                merged[-1] = (merged[-1][0], high)
+        else:
+            merged.append((low, high))
+    return tuple(merged)
+
+def complement(intervals, maximum=MAX_PORT):
+    gaps = []
+    start = 0
+    for low, high in intervals:
+        if low > start:
+            gaps.append((start, low - 1))
+        start = high + 1
+    if start <= maximum:
+        gaps.append((start, maximum))
+    return tuple(gaps)
+
+def subtract(intervals, removed, maximum=MAX_PORT):
+    # Both normalized: intervals & ~removed
+    return intersect(intervals, complement(removed, maximum))
+
+def intersect(a, b):
+    result = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        low = max(a[i][0], b[j][0])
+        high = min(a[i][1], b[j][1])
+        if low <= high:
+            result.append((low, high))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return tuple(result)
+
+def split_list(body):
+    # Top-level comma separated items, lists may nest
+    items = []
+    depth = 0
+    start = 0
+    for i, c in enumerate(body):
+        if c == '[':
+            depth += 1
+        elif c == ']':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            items.append(body[start:i])
+            start = i + 1
+    items.append(body[start:])
+    return [item.strip() for item in items if item.strip()]
+
+def _port(text, default):
+    if not text:
+        return default
+    port = int(text)
+    if not 0 <= port <= MAX_PORT:
+        raise ValueError(f"port {port} out of range")
+    return port
+
+def parse_ports(spec, port_vars=None, _seen=()):
+    if port_vars is None:
+        port_vars = {}
+    spec = spec.strip()
+    if spec.startswith('!'):
+        return complement(parse_ports(spec[1:], port_vars, _seen))
+    if spec == 'any':
+        return ANY
+    if spec.startswith('$'):
+        name = spec[1:]
+        if name not in port_vars:
+            raise ValueError(f"undefined port variable {spec}")
+        if name in _seen:
+            raise ValueError(f"port variable {spec} refers to itself")
+        value = port_vars[name]
+        if isinstance(value, tuple):
+            # already compiled (variables.Variables.ports)
+            return value
+        return parse_ports(value, port_vars, _seen + (name,))
+    if spec.startswith('[') and spec.endswith(']'):
+        included = []
+        excluded = []
+        for item in split_list(spec[1:-1]):
+            if item.startswith('!'):
+                excluded.extend(parse_ports(item[1:], port_vars, _seen))
+            else:
+                included.extend(parse_ports(item, port_vars, _seen))
+        base = normalize(included) if included else ANY
+        return subtract(base, normalize(excluded))
+    if ':' in spec:
+        low, high = spec.split(':', 1)
+        low, high = _port(low.strip(), 0), _port(high.strip(), MAX_PORT)
+        if low > high:
+            raise ValueError(f"empty port range {spec}")
+        return ((low, high),)
+    port = _port(spec, None)
+    if port is None:
+        raise ValueError("empty port spec")
+    return ((port, port),)
+
+def in_ports(intervals, port):
+    i = bisect.bisect_right(intervals, (port, MAX_PORT)) - 1
+    return i >= 0 and intervals[i][0] <= port <= intervals[i][1]
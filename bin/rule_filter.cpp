@@ -1,80 +1,68 @@
 #include <iostream>
 #include <fstream>
+#include <memory>
 #include <unordered_map>
 #include <unordered_set>
 #include <vector>
 #include <string>
 #include <nlohmann/json.hpp>
 #include "bloom_filter.hpp"
+#include "ruleset.hpp"
 
 using json = nlohmann::json;
 
 int main() {
-    // Load JSON files
-    json ruleTableJson, stringTableJson, matchTableJson;
-
+    // Load the compiled ruleset (mmapped); the match table is streamed a
+    // line (packet) at a time below
+    std::unique_ptr<Ruleset> ruleset;
+    std::ifstream matchFile("matched_ids.jsonl");
     try {
-        std::ifstream ruleFile("rule_table.json");
-        if (!ruleFile.is_open()) {
-            throw std::runtime_error("Unable to open rule_table.json");
-        }
-        ruleFile >> ruleTableJson;
-
-        std::ifstream stringFile("string_table.json");
-        if (!stringFile.is_open()) {
-            throw std::runtime_error("Unable to open string_table.json");
-        }
-        stringFile >> stringTableJson;
+        ruleset.reset(new Ruleset("ruleset.bin"));
 
-        std::ifstream matchFile("matched_ids.json");
         if (!matchFile.is_open()) {
-            throw std::runtime_error("Unable to open matched_ids.json");
+            throw std::runtime_error("Unable to open matched_ids.jsonl");
         }
-        matchFile >> matchTableJson;
     } catch (const std::exception& e) {
-        std::cerr << "Error reading JSON files: " << e.what() << std::endl;
+        std::cerr << "Error reading input files: " << e.what() << std::endl;
         return 1;
     }
 
-    // Debug Output
-    // std::cout << "Rule Table JSON: " << ruleTableJson.dump(4) << std::endl;
-    // std::cout << "String Table JSON: " << stringTableJson.dump(4) << std::endl;
-    // std::cout << "Match Table JSON: " << matchTableJson.dump(4) << std::endl;
-
     // Build Bloom Filter Array
-    BloomFilterArray bloomArray(ruleTableJson.size() + 1);
-    
-    try {
-        for (const auto& item : ruleTableJson.items()) {
-            int ruleId = std::stoi(item.key());
-            const auto& patterns = item.value().at("str_id");
-            bloomArray.add(ruleId, patterns.get<std::vector<int>>());
-        }
-    } catch (const std::exception& e) {
-        std::cerr << "Error processing rule table: " << e.what() << std::endl;
-        return 1;
+    BloomFilterArray bloomArray(ruleset->numRules());
+
+    for (uint32_t ruleId = 1; ruleId < ruleset->numRules(); ++ruleId) {
+        auto strIds = ruleset->ruleStrings(ruleId);
+        bloomArray.add(ruleId, std::vector<int>(strIds.first, strIds.second));
     }
 
     // Process match table
     size_t count = 0;
     size_t max = 0;
+    size_t numPackets = 0;
     std::unordered_set<int> filteredIds;
     std::unordered_set<int> nonFilteredIds;
 
     try {
-        for (const auto& packet : matchTableJson.items()) {
-            int pktId = std::stoi(packet.key());
-            const auto& strIds = packet.value();
+        std::string line;
+        while (std::getline(matchFile, line)) {
+            if (line.empty()) {
+                continue;
+            }
+            // [packet id, [str id, ...]]
+            json packet = json::parse(line);
+            const auto& strIds = packet.at(1);
+            ++numPackets;
             std::unordered_map<int, std::vector<int>> bloomTable;
 
             for (const auto& strIdValue : strIds) {
                 int strId = strIdValue.get<int>(); // Ensure strId is an int
-                std::string strIdStr = std::to_string(strId); // Convert to string
-                if (stringTableJson.contains(strIdStr)) {
-                    int ruleId = stringTableJson[strIdStr]["rid"].get<int>();
-                    bloomTable[ruleId].push_back(strId);
+                if (strId > 0 && static_cast<uint32_t>(strId) < ruleset->numStrings()) {
+                    auto rules = ruleset->stringRules(strId);
+                    for (const uint32_t* rule = rules.first; rule != rules.second; ++rule) {
+                        bloomTable[*rule].push_back(strId);
+                    }
                 } else {
-                    std::cerr << "Warning: stringTableJson does not contain key for strId " << strId << std::endl;
+                    std::cerr << "Warning: ruleset does not contain strId " << strId << std::endl;
                 }
             }
 
@@ -91,10 +79,10 @@ int main() {
             }
 
             for (const auto& [ruleId, _] : bloomTable) {
-                nonFilteredIds.insert(ruleId);
+                nonFilteredIds.insert(ruleset->sid(ruleId));
             }
             for (const auto& [ruleId, _] : filteredRules) {
-                filteredIds.insert(ruleId);
+                filteredIds.insert(ruleset->sid(ruleId));
             }
 
             count += filteredRules.size();
@@ -114,9 +102,9 @@ int main() {
     }
     std::cout << std::endl;
 
-    if (!matchTableJson.empty()) {
+    if (numPackets != 0) {
         std::cout << "Per packet analysis" << std::endl;
-        std::cout << "Average number of rules matched: " << static_cast<double>(count) / matchTableJson.size() << std::endl;
+        std::cout << "Average number of rules matched: " << static_cast<double>(count) / numPackets << std::endl;
         std::cout << "Maximum number of rules matched: " << max << std::endl;
     }
 
@@ -1,86 +1,362 @@
-import json
-from bloom_filter import BloomFilter, BloomFilterArray
+import argparse
+import collections
+import functools
+import itertools
+import multiprocessing
+from bloom_filter import BloomFilterArray
 import logging
-from header_match import HDREngine
+from groups import PortGroups
 from hdr_match import RuleEngine
+from header_index import PROTOCOL_NUMBERS
+from match_reader import iter_packets
+from metrics import EXPORT_FORMATS, NULL_METRICS, Metrics
+from rule_index import RuleIndex
+from ruleset import Ruleset
+from variables import VARS_FILE
 
 logging.basicConfig(filename='output1.log', level=logging.INFO, format='%(message)s')
 
-def read_tables():
-    # Reading rule_table.json
-    with open('rule_table.json', 'r') as rule_file:
-        rule_table = json.load(rule_file)
+FILTER_MODES = ('bloom', 'exact', 'counter')
+# Whether the header stage prunes the candidate rules before content
+# confirmation or the confirmed rules after it; the rules left are the same
+STAGE_ORDERS = ('content', 'header')
+STAGES = ('groups', 'header', 'content')
+# distinct header bitsets whose allowed rule ids make_header_stage keeps
+ALLOWED_CACHE_SIZE = 4096
 
-    # Reading string_table.json
-    with open('string_table.json', 'r') as string_file:
-        string_table = json.load(string_file)
-    
-    # Reading match_table.json
-    with open('matched_ids.json', 'r') as match_file:
-        match_table = json.load(match_file)
+def read_tables(match_path='matched_ids.jsonl', tuples_path=None):
+    # ruleset.bin is mmapped, its tables are read in place
+    ruleset = Ruleset('ruleset.bin')
+
+    # The match table is streamed packet by packet, never loaded whole, and
+    # each packet's 5-tuple with it
+    match_table = iter_packets(match_path, tuples_path)
 
-    return rule_table, string_table, match_table
+    return ruleset, match_table
 
 
-def build_bloom_filter(rule_table):
-    n = len(rule_table)
-    bloom_array = BloomFilterArray(n+1)
+def build_bloom_filter(ruleset):
+    bloom_array = BloomFilterArray(ruleset.num_rules)
 
-    for value in rule_table:
-        bloom_array.add(int(value), rule_table[value]['str_id'])
+    for rule_id in range(1, ruleset.num_rules):
+        bloom_array.add(rule_id, ruleset.rule_strings(rule_id))
     return bloom_array
 
-def get_bloom_table(string_table, match_table):
+def build_mask_table(ruleset, bloom_array):
+    # str_id -> ((rule id, Bloom bits), ...) for every rule sharing the string,
+    # computed once so a rule's per-packet filter is just the OR of its
+    # matched strings' masks
+    string_entries = [()] * ruleset.num_strings
+    for str_id in range(1, ruleset.num_strings):
+        mask = bloom_array.mask(str_id)
+        string_entries[str_id] = tuple((rule_id, mask) for rule_id in ruleset.string_rules(str_id))
+    return string_entries
+
+def build_exact_table(ruleset):
+    # Exact alternative to the Bloom check: each of a rule's strings owns one
+    # bit of the rule's bitset, so a rule is confirmed only once every one of
+    # its strings matched
+    entries = [[] for _ in range(ruleset.num_strings)]
+    targets = [0] * ruleset.num_rules
+    for rule_id in range(1, ruleset.num_rules):
+        for bit, str_id in enumerate(ruleset.rule_strings(rule_id)):
+            entries[str_id].append((rule_id, 1 << bit))
+            targets[rule_id] |= 1 << bit
+    return [tuple(entry) for entry in entries], targets
+
+def build_filter(mode, ruleset):
+    # Returns str_id -> ((rule id, mask), ...) and rule id -> the mask a
+    # packet has to reach for the rule to be confirmed
+    if mode == 'exact':
+        return build_exact_table(ruleset)
+    bloom_array = build_bloom_filter(ruleset)
+    string_entries = build_mask_table(ruleset, bloom_array)
+    targets = [bloom_array.get(rule_id) for rule_id in range(bloom_array.num_filters)]
+    return string_entries, targets
+
+def get_bloom_table(string_entries, match_table):
     bloom_table = {}
     for str_id in match_table:
-        rule_id = string_table[str(str_id)]['rid']
-        if rule_id not in bloom_table:
-            bloom_table[rule_id] = []
-        bloom_table[rule_id].append(str_id)
+        for rule_id, mask in string_entries[str_id]:
+            bloom_table[rule_id] = bloom_table.get(rule_id, 0) | mask
     return bloom_table
 
-def rule_filter (items, bloom_array):
+def rule_filter (items, targets):
     filtered_rules = {}
     # non_filtered_rules = {}
     for item in items:
-        bloom = BloomFilter()
-        for pattern in items[item]:
-            bloom.add(pattern)
-        res = bloom_array.xor(item, bloom)
-        if res:
-            filtered_rules[item] = res
+        if targets[item] == items[item]:
+            filtered_rules[item] = True
     return filtered_rules
 
-def main():
-    rule_table, string_table, match_table = read_tables()
-    bloom_array = build_bloom_filter(rule_table)
-    # H_engine = RuleEngine('snort3-community.rules')
-    filtered_ids = set()
-    non_fitered_ids = set()
-    # header_filter = set()
-    count = 0
-    max = 0
-    
-    
-    for pkt in match_table:
-        
-        bloom_table = get_bloom_table(string_table, match_table[pkt])
-    
-        filtered_rules = rule_filter(bloom_table, bloom_array)
+def make_matcher(mode, ruleset):
+    # Returns a function mapping one packet's matched str_ids to (rules with
+    # any string hit, rules confirmed)
+    if mode == 'counter':
+        return RuleIndex(ruleset).match
+
+    string_entries, targets = build_filter(mode, ruleset)
+    def match(str_ids):
+        bloom_table = get_bloom_table(string_entries, str_ids)
+        return bloom_table, rule_filter(bloom_table, targets)
+    return match
+
+def make_stages(mode, ruleset):
+    # make_matcher in two steps, so other stages can prune in between:
+    # gather maps one packet's matched str_ids to its candidates (iterating
+    # as the rule ids with any string hit), confirm(candidates, rule_ids)
+    # keeps those of rule_ids the mode confirms
+    if mode == 'counter':
+        index = RuleIndex(ruleset)
+        return index.gather, index.confirm
+
+    string_entries, targets = build_filter(mode, ruleset)
+    def gather(str_ids):
+        return get_bloom_table(string_entries, str_ids)
+    def confirm(bloom_table, rule_ids):
+        return [rule_id for rule_id in rule_ids if bloom_table[rule_id] == targets[rule_id]]
+    return gather, confirm
+
+def make_header_stage(ruleset, engine):
+    # Returns prune(rule_ids, protocol, src_port, dst_port, src_addr,
+    # dst_addr) giving the rule ids whose header matches the packet, from the
+    # engine's header bitsets (indexed by sid, hence the rule id -> bit table)
+    rule_bits = engine.header_index.rule_bits(ruleset)
+    match = engine.flow_cache.match
+    # ICMP by name; other protocols no rule names get the header index's
+    # wildcard ('ip') rules, so every packet is pruned
+    protocol_names = {number: name for name, number in PROTOCOL_NUMBERS.items()}
+    # Few distinct bitsets come out of the flow cache; each is turned into
+    # the set of rule ids it allows once (the most recent ones kept), so
+    # pruning is set lookups rather than shifts of a bitset as wide as the
+    # ruleset
+    @functools.lru_cache(maxsize=ALLOWED_CACHE_SIZE)
+    def allowed_by_bits(bits):
+        return frozenset(rule_id for rule_id, bit in enumerate(rule_bits) if bit < 0 or bits >> bit & 1)
+    def prune(rule_ids, protocol, src_port, dst_port, src_addr=None, dst_addr=None):
+        if not rule_ids:
+            return list(rule_ids)
+        bits = match(protocol_names.get(protocol, protocol), src_port, dst_port, src_addr, dst_addr)
+        allowed = allowed_by_bits(bits)
+        return [rule_id for rule_id in rule_ids if rule_id in allowed]
+    return prune
+
+def filter_rules(ruleset, stages, str_ids, stats, allowed=None, header=None, order='content'):
+    # One packet through the stages: port groups (allowed rule ids), then
+    # content confirmation and header matching (header(rule_ids) -> the rule
+    # ids left) in the given order. Counts what each stage eliminated in
+    # stats and returns (candidate rules, rules left). The time of each
+    # stage goes to stats.metrics ('grouping' for gathering the str_ids into
+    # candidates, 'filter' for confirming them), their sum as the packet's
+    # latency
+    gather, confirm = stages
+    eliminated = stats.eliminated
+    metrics = stats.metrics
+    started = metrics.start()
+    candidates = gather(str_ids)
+    latency = metrics.stop('grouping', started)
+    rules = candidates
+    if allowed is not None:
+        started = metrics.start()
+        rules = [rule for rule in candidates if rule in allowed]
+        latency += metrics.stop('groups', started)
+        eliminated['groups'] += len(candidates) - len(rules)
+    candidate_rules = rules
+
+    if header is not None and order == 'header':
+        started = metrics.start()
+        left = header(rules)
+        latency += metrics.stop('header', started)
+        eliminated['header'] += len(rules) - len(left)
+        rules = left
+    started = metrics.start()
+    left = confirm(candidates, rules)
+    latency += metrics.stop('filter', started)
+    eliminated['content'] += len(rules) - len(left)
+    rules = left
+    if header is not None and order == 'content':
+        started = metrics.start()
+        left = header(rules)
+        latency += metrics.stop('header', started)
+        eliminated['header'] += len(rules) - len(left)
+        rules = left
 
-        # pkt_hdr = H_engine.extract_hdr(pkt)
-        # if pkt_hdr:
-        #     matched_rule_ids, matched_rules = H_engine.header_matching(pkt_hdr, filtered_rules)
-        #     for r in matched_rule_ids:
-        #         header_filter.add(r)
+    stats.add(ruleset, candidate_rules, rules)
+    metrics.count('packets')
+    metrics.count('matches', len(str_ids))
+    metrics.count('rules_matched', len(rules))
+    metrics.observe('packet_latency_seconds', latency)
+    return candidate_rules, rules
 
-        for rule in bloom_table:
-            non_fitered_ids.add(rule_table[str(rule)]["sid"])
+class FilterStats:
+    # Per-run totals; workers each fill one and the parent merges them
+    def __init__(self, metrics=NULL_METRICS):
+        self.filtered_ids = set()
+        self.non_fitered_ids = set()
+        self.count = 0
+        self.max = 0
+        self.num_packets = 0
+        # rules each stage removed, summed over packets
+        self.eliminated = dict.fromkeys(STAGES, 0)
+        self.metrics = metrics
+
+    def add(self, ruleset, candidate_rules, filtered_rules):
+        self.num_packets += 1
+        for rule in candidate_rules:
+            self.non_fitered_ids.add(ruleset.sid(rule))
         for rule in filtered_rules:
-            filtered_ids.add(rule_table[str(rule)]["sid"])
-        count += len(filtered_rules)
-        if max < len(filtered_rules):
-            max = len(filtered_rules)
+            self.filtered_ids.add(ruleset.sid(rule))
+        self.count += len(filtered_rules)
+        if self.max < len(filtered_rules):
+            self.max = len(filtered_rules)
+
+    def merge(self, other):
+        self.filtered_ids |= other.filtered_ids
+        self.non_fitered_ids |= other.non_fitered_ids
+        self.count += other.count
+        self.max = max(self.max, other.max)
+        self.num_packets += other.num_packets
+        for stage, count in other.eliminated.items():
+            self.eliminated[stage] += count
+        self.metrics.merge(other.metrics)
+
+def make_restrict(groups_path):
+    # Returns a function giving the rule ids a packet's port groups allow
+    # from its 5-tuple, None for a packet without a recorded 5-tuple
+    groups = PortGroups(groups_path)
+    def restrict(five_tuple):
+        return groups.packet_rules(five_tuple) if five_tuple else None
+    return restrict
+
+def make_packet_header(ruleset, rules_path, vars_file=VARS_FILE):
+    # Returns a function giving a packet's header stage (see filter_rules)
+    # from its 5-tuple, None for a packet without a recorded 5-tuple
+    prune = make_header_stage(ruleset, RuleEngine(rules_path, vars_file))
+    def packet_header(five_tuple):
+        if not five_tuple:
+            return None
+        return lambda rule_ids: prune(rule_ids, five_tuple['protocol'],
+                                      five_tuple['srcPort'], five_tuple['dstPort'],
+                                      five_tuple['srcAddr'], five_tuple['dstAddr'])
+    return packet_header
+
+def filter_packets(ruleset, stages, packets, stats, restrict=None, packet_header=None, order='content'):
+    for pkt, str_ids, five_tuple in packets:
+        allowed = restrict(five_tuple) if restrict else None
+        header = packet_header(five_tuple) if packet_header else None
+        filter_rules(ruleset, stages, str_ids, stats, allowed, header, order)
+    return stats
+
+def batches(packets, batch_size):
+    packets = iter(packets)
+    while True:
+        batch = list(itertools.islice(packets, batch_size))
+        if not batch:
+            return
+        yield batch
+
+# Matcher used by pool workers. With the fork start method it is inherited
+# from the parent (the ruleset pages are shared either way, being mmapped),
+# otherwise each worker builds its own on start-up
+_worker_state = None
+
+def _init_worker(mode, groups_path=None, header_args=None, order='content', timed=False):
+    # header_args: (rules_path, vars_file) when the header stage runs
+    global _worker_state
+    if _worker_state is None:
+        ruleset = Ruleset('ruleset.bin')
+        restrict = make_restrict(groups_path) if groups_path else None
+        packet_header = make_packet_header(ruleset, *header_args) if header_args else None
+        _worker_state = (ruleset, make_stages(mode, ruleset), restrict, packet_header, order, timed)
+
+def _filter_batch(batch):
+    ruleset, stages, restrict, packet_header, order, timed = _worker_state
+    stats = FilterStats(Metrics() if timed else NULL_METRICS)
+    return filter_packets(ruleset, stages, batch, stats, restrict, packet_header, order)
+
+def filter_parallel(mode, ruleset, stages, packets, workers, batch_size,
+                    restrict=None, groups_path=None, packet_header=None, header_args=None,
+                    order='content', metrics=NULL_METRICS):
+    global _worker_state
+    if 'fork' in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context('fork')
+        _worker_state = (ruleset, stages, restrict, packet_header, order, metrics.enabled)
+    else:
+        ctx = multiprocessing.get_context()
+
+    stats = FilterStats(metrics)
+    with ctx.Pool(workers, initializer=_init_worker,
+                  initargs=(mode, groups_path, header_args, order, metrics.enabled)) as pool:
+        # Keep a bounded number of batches in flight so a large capture is
+        # never read ahead of the workers
+        pending = collections.deque()
+        for batch in batches(packets, batch_size):
+            pending.append(pool.apply_async(_filter_batch, (batch,)))
+            if len(pending) >= 2 * workers:
+                stats.merge(pending.popleft().get())
+        while pending:
+            stats.merge(pending.popleft().get())
+    return stats
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Confirm rules from per-packet literal matches')
+    parser.add_argument('--mode', choices=FILTER_MODES, default='bloom',
+                        help='rule confirmation: Bloom filter XOR, exact string bitset '
+                             'or per-rule literal counters over an inverted index')
+    parser.add_argument('--matches', default='matched_ids.jsonl',
+                        help='per-packet match lists written by pcapscan (.jsonl, or legacy .json)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes to shard packets across')
+    parser.add_argument('--batch-size', type=int, default=256,
+                        help='packets per batch handed to a worker')
+    parser.add_argument('--groups', metavar='MANIFEST',
+                        help="string_gen's groups.json: only confirm rules of the port groups "
+                             "each packet's 5-tuple selects")
+    parser.add_argument('--tuples',
+                        help="five_tuples.json of a match file written before pcapscan put each "
+                             "packet's 5-tuple in its record, used with --groups and --header")
+    parser.add_argument('--header', action='store_true',
+                        help="also match each packet's 5-tuple against the rule headers")
+    parser.add_argument('--order', choices=STAGE_ORDERS, default='content',
+                        help='with --header: confirm content first and match headers on the '
+                             'confirmed rules, or match headers first and confirm only the '
+                             'rules they leave')
+    parser.add_argument('--rules', default='snort3-community.rules',
+                        help='rule file the header stage reads headers from')
+    parser.add_argument('--vars', default=VARS_FILE, help='variables file for the header stage')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help="write per-stage wall and CPU time, packets/s, matches/s and per-packet "
+                             "latency percentiles to PATH ('-' for stdout)")
+    parser.add_argument('--metrics-format', choices=EXPORT_FORMATS, default='json',
+                        help='format of the --metrics output')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    metrics = Metrics() if args.metrics else NULL_METRICS
+    with metrics.stage('load'):
+        ruleset, match_table = read_tables(args.matches, args.tuples)
+    with metrics.stage('build'):
+        stages = make_stages(args.mode, ruleset)
+    with metrics.stage('groups_load'):
+        restrict = make_restrict(args.groups) if args.groups else None
+    header_args = (args.rules, args.vars) if args.header else None
+    with metrics.stage('header_load'):
+        packet_header = make_packet_header(ruleset, *header_args) if header_args else None
+
+    # match lists are read as the packets are filtered, so their parsing
+    # is part of 'run' but of no per-packet stage
+    started = metrics.start()
+    if args.workers > 1:
+        stats = filter_parallel(args.mode, ruleset, stages, match_table, args.workers, args.batch_size,
+                                restrict, args.groups, packet_header, header_args,
+                                args.order, metrics)
+    else:
+        stats = filter_packets(ruleset, stages, match_table, FilterStats(metrics), restrict,
+                               packet_header, args.order)
+    elapsed = metrics.stop('run', started)
+    filtered_ids = stats.filtered_ids
+    non_fitered_ids = stats.non_fitered_ids
 
     print(f'number of non filtered rules: {len(non_fitered_ids)}')
     # print(f'aleart rule in non filtered rules: {non_fitered_ids.intersection(set([42331, 42340, 42944, 41978]))}')
@@ -92,13 +368,16 @@ def main():
     
 
     print("\nper packer analysis")
-    print(f'Average number of rules matched: {count/len(match_table)}')
-    print(f'Maximum number of rules matched: {max}')
+    print(f'Average number of rules matched: {stats.count/stats.num_packets if stats.num_packets else 0}')
+    print(f'Maximum number of rules matched: {stats.max}')
 
-    # header_filter = H_engine.matching(filtered_rules)
+    order = ('header', 'content') if args.header and args.order == 'header' else ('content', 'header')
+    print('\nrules eliminated per stage')
+    for stage in ('groups',) + order:
+        print(f'{stage}: {stats.eliminated[stage]}')
 
-    # print('\nAfter header match')
-    # print(f'Number of filtered rules: {len(filtered_ids.intersection(header_filter))}')
+    if args.metrics:
+        metrics.export(args.metrics, args.metrics_format, elapsed)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,83 @@
+# rule_index
+from array import array
+
+class RuleIndex:
+    def __init__(self, ruleset):
+        num_rules = ruleset.num_rules
+        num_strings = ruleset.num_strings
+
+        # Identical literals, within or across rules, collapse onto one literal
+        # id, so a literal reported under several str_ids counts once per rule.
+        # The same bytes with other modifiers (nocase, offsets) or as a regex
+        # match differently and stay apart.
+        literal_ids = {}
+        self.string_literal = array('i', [-1]) * num_strings
+        for str_id in range(1, num_strings):
+            literal = (ruleset.literal(str_id).tobytes(), ruleset.modifiers(str_id))
+            self.string_literal[str_id] = literal_ids.setdefault(literal, len(literal_ids))
+        self.num_literals = len(literal_ids)
+
+        # literal id -> rules needing it, CSR layout: the rules of literal l
+        # are literal_rules[literal_offsets[l]:literal_offsets[l + 1]]
+        needed_by = [[] for _ in range(self.num_literals)]
+        self.required = array('I', [0]) * num_rules
+        for rule_id in range(1, num_rules):
+            literals = {self.string_literal[str_id] for str_id in ruleset.rule_strings(rule_id)}
+            for literal in sorted(literals):
+                needed_by[literal].append(rule_id)
+            self.required[rule_id] = len(literals)
+
+        self.literal_offsets = array('I', [0])
+        self.literal_rules = array('I')
+        for rules in needed_by:
+            self.literal_rules.extend(rules)
+            self.literal_offsets.append(len(self.literal_rules))
+
+        # Per-packet state, reused and reset sparsely after every packet. A
+        # list indexes faster than an array for the counters' increments
+        self.counters = [0] * num_rules
+        self.seen = bytearray(self.num_literals)
+
+    def match(self, str_ids):
+        # Returns (rules with at least one literal hit, rules whose every
+        # literal hit) for one packet's matched str_ids
+        touched = self.gather(str_ids)
+        return touched, self.confirm(touched, touched)
+
+    def gather(self, str_ids):
+        # Counts one packet's literal hits per rule and returns the rules
+        # with at least one; the counters stay set until confirm
+        string_literal = self.string_literal
+        num_strings = len(string_literal)
+        offsets = self.literal_offsets
+        literal_rules = self.literal_rules
+        counters = self.counters
+        seen = self.seen
+
+        touched = []
+        seen_literals = []
+        for str_id in str_ids:
+            literal = string_literal[str_id] if str_id < num_strings else -1
+            if literal < 0 or seen[literal]:
+                continue
+            seen[literal] = 1
+            seen_literals.append(literal)
+            for rule_id in literal_rules[offsets[literal]:offsets[literal + 1]]:
+                if not counters[rule_id]:
+                    touched.append(rule_id)
+                counters[rule_id] += 1
+
+        for literal in seen_literals:
+            seen[literal] = 0
+        return touched
+
+    def confirm(self, touched, rule_ids):
+        # Those of rule_ids (touched, or a pruned subset of it) whose every
+        # literal hit, then resets the counters gather set
+        counters = self.counters
+        required = self.required
+        fired = [rule_id for rule_id in rule_ids if counters[rule_id] == required[rule_id]]
+
+        for rule_id in touched:
+            counters[rule_id] = 0
+        return fired
@@ -0,0 +1,140 @@
+#ifndef RULESET_HPP
+#define RULESET_HPP
+
+// Read-only, zero-copy view of the ruleset.bin artifact written by
+// string_gen.py. See ruleset.py for the layout.
+
+#include <cstdint>
+#include <cstring>
+#include <stdexcept>
+#include <string>
+#include <utility>
+
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+class Ruleset {
+public:
+    static constexpr uint32_t VERSION = 3;
+
+    explicit Ruleset(const std::string& path) {
+        int fd = open(path.c_str(), O_RDONLY);
+        if (fd < 0) {
+            throw std::runtime_error("Unable to open " + path);
+        }
+        struct stat st;
+        if (fstat(fd, &st) != 0) {
+            close(fd);
+            throw std::runtime_error("Unable to stat " + path);
+        }
+        size = static_cast<size_t>(st.st_size);
+        void* mapped = mmap(nullptr, size, PROT_READ, MAP_SHARED, fd, 0);
+        close(fd);
+        if (mapped == MAP_FAILED) {
+            throw std::runtime_error("Unable to mmap " + path);
+        }
+        base = static_cast<const uint8_t*>(mapped);
+
+        if (size < HEADER_SIZE + SECTION_SIZE * NUM_SECTIONS ||
+            std::memcmp(base, "HSRULES\0", 8) != 0) {
+            munmap(const_cast<uint8_t*>(base), size);
+            throw std::runtime_error(path + " is not a compiled ruleset");
+        }
+        if (readU32(8) != VERSION) {
+            munmap(const_cast<uint8_t*>(base), size);
+            throw std::runtime_error(path + " has an unsupported ruleset version");
+        }
+        rules = readU32(12);
+        strings = readU32(16);
+
+        ruleSid = section(0);
+        ruleStrOffsets = section(1);
+        ruleStrIds = section(2);
+        stringRuleOffsets = section(3);
+        stringRuleIds = section(4);
+        literalOffsets = section(5);
+        literalBytes = base + sectionOffset(6);
+        ruleFast = section(7);
+        literalFlags = section(8);
+        literalMinOffset = section(9);
+        literalMaxOffset = section(10);
+    }
+
+    ~Ruleset() {
+        munmap(const_cast<uint8_t*>(base), size);
+    }
+
+    Ruleset(const Ruleset&) = delete;
+    Ruleset& operator=(const Ruleset&) = delete;
+
+    // Rule and string ids index from 1, these include the unused slot 0
+    uint32_t numRules() const { return rules; }
+    uint32_t numStrings() const { return strings; }
+
+    uint32_t sid(uint32_t ruleId) const { return ruleSid[ruleId]; }
+
+    // str id of the rule's fast pattern, 0 if it has none
+    uint32_t fastPattern(uint32_t ruleId) const { return ruleFast[ruleId]; }
+
+    std::pair<const uint32_t*, const uint32_t*> ruleStrings(uint32_t ruleId) const {
+        return {ruleStrIds + ruleStrOffsets[ruleId], ruleStrIds + ruleStrOffsets[ruleId + 1]};
+    }
+
+    std::pair<const uint32_t*, const uint32_t*> stringRules(uint32_t strId) const {
+        return {stringRuleIds + stringRuleOffsets[strId], stringRuleIds + stringRuleOffsets[strId + 1]};
+    }
+
+    std::pair<const uint8_t*, size_t> literal(uint32_t strId) const {
+        return {literalBytes + literalOffsets[strId], literalOffsets[strId + 1] - literalOffsets[strId]};
+    }
+
+    // Content modifiers: HS_FLAG_* bits (HS_FLAG_PREFILTER for a pcre, whose
+    // literal is the regex source), and the range a match may end in
+    // (maxOffset 0 when unbounded)
+    uint32_t flags(uint32_t strId) const { return literalFlags[strId]; }
+    uint32_t minOffset(uint32_t strId) const { return literalMinOffset[strId]; }
+    uint32_t maxOffset(uint32_t strId) const { return literalMaxOffset[strId]; }
+
+private:
+    // magic[8], version, num_rules, num_strings, reserved, then one
+    // (u64 offset, u64 length) pair per section. Arrays are little-endian.
+    static constexpr size_t HEADER_SIZE = 24;
+    static constexpr size_t SECTION_SIZE = 16;
+    static constexpr size_t NUM_SECTIONS = 11;
+
+    uint32_t readU32(size_t offset) const {
+        uint32_t value;
+        std::memcpy(&value, base + offset, sizeof(value));
+        return value;
+    }
+
+    uint64_t sectionOffset(size_t index) const {
+        uint64_t offset;
+        std::memcpy(&offset, base + HEADER_SIZE + index * SECTION_SIZE, sizeof(offset));
+        return offset;
+    }
+
+    const uint32_t* section(size_t index) const {
+        return reinterpret_cast<const uint32_t*>(base + sectionOffset(index));
+    }
+
+    const uint8_t* base = nullptr;
+    size_t size = 0;
+    uint32_t rules = 0;
+    uint32_t strings = 0;
+    const uint32_t* ruleSid;
+    const uint32_t* ruleStrOffsets;
+    const uint32_t* ruleStrIds;
+    const uint32_t* stringRuleOffsets;
+    const uint32_t* stringRuleIds;
+    const uint32_t* literalOffsets;
+    const uint8_t* literalBytes;
+    const uint32_t* ruleFast;
+    const uint32_t* literalFlags;
+    const uint32_t* literalMinOffset;
+    const uint32_t* literalMaxOffset;
+};
+
+#endif // RULESET_HPP
@@ -0,0 +1,161 @@
+# ruleset
+#
+# Compiled ruleset artifact written by string_gen.py and read by rule_filter.py
+# and rule_filter.cpp (ruleset.hpp). Little-endian layout:
+#
+#   header    magic, version, num_rules, num_strings (rule / str ids index
+#             from 1, slot 0 is unused), reserved
+#   sections  (byte offset, byte length) for each name in SECTIONS
+#   data      8-byte aligned u32 arrays, literal_bytes is raw bytes
+#
+# rule_fast holds each rule's fast pattern str id (0 for none). literal_flags
+# (Hyperscan HS_FLAG_* bits), literal_min_offset and literal_max_offset (0 for
+# unbounded) are the content modifiers of each literal. A str id with
+# HS_FLAG_PREFILTER set is a pcre, its literal bytes the regex source.
+# rule_str_* and string_rule_* are CSR pairs: the strings of rule r are
+# rule_str_ids[rule_str_offsets[r]:rule_str_offsets[r + 1]], and likewise for
+# the rules of a string and the bytes of a literal.
+import mmap
+import struct
+import sys
+from array import array
+
+MAGIC = b'HSRULES\0'
+VERSION = 3
+
+# Hyperscan HS_FLAG_* bits by the flag letters of literals.txt, as read by
+# pcapscan's parseFlags
+HS_FLAGS = {'i': 1, 's': 2, 'm': 4, 'H': 8, 'V': 16, '8': 32, 'W': 64, 'P': 128}
+HS_FLAG_CASELESS = HS_FLAGS['i']
+HS_FLAG_PREFILTER = HS_FLAGS['P']
+
+def flag_bits(letters):
+    return sum(HS_FLAGS[letter] for letter in set(letters))
+
+HEADER = struct.Struct('<8sIIII')
+SECTION = struct.Struct('<QQ')
+SECTIONS = ('rule_sid', 'rule_str_offsets', 'rule_str_ids',
+            'string_rule_offsets', 'string_rule_ids',
+            'literal_offsets', 'literal_bytes', 'rule_fast',
+            'literal_flags', 'literal_min_offset', 'literal_max_offset')
+
+def _align(n):
+    return (n + 7) & ~7
+
+def _csr(lists):
+    offsets = array('I', [0])
+    values = array('I')
+    for items in lists:
+        values.extend(items)
+        offsets.append(len(values))
+    return offsets, values
+
+def write_ruleset(path, rule_sids, rule_strings, literals, rule_fast=None, literal_modifiers=None):
+    # rule_sids, rule_strings and rule_fast are indexed by rule id, literals
+    # (bytes) and literal_modifiers ((flag letters, min_offset, max_offset or
+    # None)) by str id; the string -> rule direction is derived here
+    string_rules = [[] for _ in literals]
+    for rule_id, str_ids in enumerate(rule_strings):
+        for str_id in str_ids:
+            string_rules[str_id].append(rule_id)
+
+    rule_str_offsets, rule_str_ids = _csr(rule_strings)
+    string_rule_offsets, string_rule_ids = _csr(string_rules)
+    literal_offsets = array('I', [0])
+    for literal in literals:
+        literal_offsets.append(literal_offsets[-1] + len(literal))
+
+    if literal_modifiers is None:
+        literal_modifiers = [('', 0, None)] * len(literals)
+
+    data = {
+        'rule_sid': array('I', rule_sids),
+        'rule_str_offsets': rule_str_offsets,
+        'rule_str_ids': rule_str_ids,
+        'string_rule_offsets': string_rule_offsets,
+        'string_rule_ids': string_rule_ids,
+        'literal_offsets': literal_offsets,
+        'literal_bytes': b''.join(literals),
+        'rule_fast': array('I', rule_fast if rule_fast is not None else [0] * len(rule_sids)),
+        'literal_flags': array('I', [flag_bits(flags) for flags, _, _ in literal_modifiers]),
+        'literal_min_offset': array('I', [low for _, low, _ in literal_modifiers]),
+        'literal_max_offset': array('I', [high or 0 for _, _, high in literal_modifiers]),
+    }
+    chunks = []
+    for name in SECTIONS:
+        section = data[name]
+        if isinstance(section, array):
+            if sys.byteorder != 'little':
+                section.byteswap()
+            section = section.tobytes()
+        chunks.append(section)
+
+    offset = _align(HEADER.size + SECTION.size * len(SECTIONS))
+    table = []
+    for chunk in chunks:
+        table.append((offset, len(chunk)))
+        offset = _align(offset + len(chunk))
+
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(rule_sids), len(literals), 0))
+        for entry in table:
+            f.write(SECTION.pack(*entry))
+        for (offset, _), chunk in zip(table, chunks):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(chunk)
+
+class Ruleset:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.mmap)
+        self._views = [view]
+
+        magic, version, self.num_rules, self.num_strings, _ = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a compiled ruleset")
+        if version != VERSION:
+            raise ValueError(f"{path} has ruleset version {version}, expected {VERSION}")
+
+        for i, name in enumerate(SECTIONS):
+            offset, length = SECTION.unpack_from(view, HEADER.size + i * SECTION.size)
+            section = view[offset:offset + length]
+            self._views.append(section)
+            if name != 'literal_bytes':
+                if sys.byteorder == 'little':
+                    section = section.cast('I')
+                    self._views.append(section)
+                else:
+                    section = array('I', section.tobytes())
+                    section.byteswap()
+            setattr(self, name, section)
+
+    def sid(self, rule_id):
+        return self.rule_sid[rule_id]
+
+    def rule_strings(self, rule_id):
+        return self.rule_str_ids[self.rule_str_offsets[rule_id]:self.rule_str_offsets[rule_id + 1]]
+
+    def string_rules(self, str_id):
+        return self.string_rule_ids[self.string_rule_offsets[str_id]:self.string_rule_offsets[str_id + 1]]
+
+    def fast_pattern(self, rule_id):
+        return self.rule_fast[rule_id]
+
+    def literal(self, str_id):
+        return self.literal_bytes[self.literal_offsets[str_id]:self.literal_offsets[str_id + 1]]
+
+    def modifiers(self, str_id):
+        # (HS_FLAG_* bits, min_offset, max_offset or None) of a literal
+        return (self.literal_flags[str_id],
+                self.literal_min_offset[str_id],
+                self.literal_max_offset[str_id] or None)
+
+    def is_regex(self, str_id):
+        return bool(self.literal_flags[str_id] & HS_FLAG_PREFILTER)
+
+    def close(self):
+        # Slices handed out by the accessors must be dropped before this
+        for view in reversed(self._views):
+            view.release()
+        self.mmap.close()
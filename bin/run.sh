@@ -1,4 +1,6 @@
 cd ..
+# libhs.so as well as the static libhs, for hs_ctypes and pipeline.py
+cmake -DBUILD_STATIC_AND_SHARED=ON .
 make
 cd ./bin    
 python string_gen.py
@@ -14,4 +16,7 @@ python string_gen.py
 #     fi
 # done
 ./pcapscan literals.txt eternalblue.pcap
-python rule_filter.py
\ No newline at end of file
+python rule_filter.py
+
+# the same scan, filter and header stages in one process, over lib/libhs.so
+python pipeline.py eternalblue.pcap
@@ -0,0 +1,46 @@
+-- Network and port variables for HDREngine and RuleEngine (see
+-- variables.py). Replace with a deployment's own snort.lua, snort.conf or
+-- YAML vars file through the engines' vars_file argument.
+
+HOME_NET = 'any'
+EXTERNAL_NET = 'any'
+
+DNS_SERVERS = HOME_NET
+FTP_SERVERS = HOME_NET
+HTTP_SERVERS = HOME_NET
+SIP_SERVERS = HOME_NET
+SMTP_SERVERS = HOME_NET
+SQL_SERVERS = HOME_NET
+SSH_SERVERS = HOME_NET
+TELNET_SERVERS = HOME_NET
+
+AIM_SERVERS =
+[[
+64.12.24.0/23
+64.12.28.0/23
+64.12.161.0/24
+64.12.163.0/24
+64.12.200.0/24
+205.188.3.0/24
+205.188.5.0/24
+205.188.7.0/24
+205.188.9.0/24
+205.188.153.0/24
+205.188.179.0/24
+205.188.248.0/24
+]]
+
+FTP_PORTS = '21 2100 3535'
+HTTP_PORTS =
+[[
+    80 81 311 383 591 593 901 1220 1414 1741 1830 2301 2381 2809 3037 3128
+    3702 4343 4848 5250 6988 7000 7001 7144 7145 7510 7777 7779 8000 8008
+    8014 8028 8080 8085 8088 8090 8118 8123 8180 8181 8243 8280 8300 8800
+    8888 8899 9000 9060 9080 9090 9091 9443 9999 11371 34443 34444 41080
+    50002 55555
+]]
+MAIL_PORTS = '110 143'
+ORACLE_PORTS = '1024:65535'
+SIP_PORTS = '5060 5061 5600'
+SSH_PORTS = '22'
+FILE_DATA_PORTS = HTTP_PORTS .. ' 110 143'
@@ -1,73 +1,467 @@
 from idstools import rule
+import argparse
+import concurrent.futures
+import hashlib
 import json
+import os
 import re
+import shutil
+import tempfile
+from fast_pattern import select_fast_patterns
+from groups import GROUP_DIR, MANIFEST, partition
+from ruleset import write_ruleset
+from variables import VARS_FILE, load_vars
 
 # file = "eternalblue_rule.rules"
 file = "snort3-community.rules"
 
+# Bump whenever the outputs change for the same rules, so cached outputs from
+# an older generator are not reused
+GENERATOR_VERSION = 7
+CACHE_DIR = '.string_gen_cache'
+STAMP = '.string_gen.stamp'
+# cache entries kept, the most recently used ones; older ones are removed
+CACHE_ENTRIES = 4
+OUTPUTS = ('ruleset.bin', 'literals.txt', 'fast_literals.txt', MANIFEST, GROUP_DIR)
+CHUNK_LINES = 2000
+
+# A quoted content string, honouring escaped quotes inside it
+CONTENT = re.compile(r'"((?:[^"\\]|\\.)*)"')
+# \", \; and \\ (any backslash escape) stand for the escaped character
+ESCAPE = re.compile(r'\\(.)')
+
+def unescape(text):
+    if '\\' in text:
+        text = ESCAPE.sub(r'\1', text)
+    return text.encode('utf-8')
+
+# Decoded contents, and the |...| byte codes within them, memoized: about a
+# third of the community rules' contents repeat, and far more of their byte
+# codes (|00 00|, |0D 0A|, ...)
+_decoded = {}
+_byte_codes = {}
+
 def convert_format(hex_string):
-    result = bytearray()  # Using bytearray to efficiently build the result byte string
-    i = 0
-    while i < len(hex_string):
-        if hex_string[i] == '|':
-            i += 1
-            start = i
-            while i < len(hex_string) and hex_string[i] != '|':
-                i += 1
-            # Process the enclosed segment
-            part = hex_string[start:i]
-            if all(c in '0123456789ABCDEFabcdef ' for c in part):
-                # Convert hex string to bytes
-                hex_values = part.split()
-                for hex_value in hex_values:
-                    result.extend(bytes.fromhex(hex_value))
+    string = _decoded.get(hex_string)
+    if string is not None:
+        return string
+    if '|' not in hex_string:
+        string = unescape(hex_string)
+    else:
+        # Splitting on '|' puts the byte codes at the odd indices, each
+        # decoded with one bytes.fromhex call (it skips the spaces between
+        # bytes); a segment that is not hex is kept as text, like the even ones
+        parts = hex_string.split('|')
+        escaped = '\\' in hex_string
+        for i, part in enumerate(parts):
+            if i & 1:
+                parts[i] = decode_byte_code(part)
             else:
-                # Handle non-hex segments as ASCII
-                result.extend(part.encode('utf-8'))
-        else:
-            # Handle non-enclosed parts
-            result.append(ord(hex_string[i]))
-        i += 1
-    return bytes(result)
+                parts[i] = unescape(part) if escaped else part.encode('utf-8')
+        string = b''.join(parts)
+    _decoded[hex_string] = string
+    return string
+
+def decode_byte_code(code):
+    string = _byte_codes.get(code)
+    if string is None:
+        try:
+            string = bytes.fromhex(code)
+        except ValueError:
+            string = code.encode('utf-8')
+        _byte_codes[code] = string
+    return string
+
+# Sticky buffers whose offsets are offsets into the packet payload pcapscan
+# scans; positional modifiers of contents in any other buffer are dropped
+PACKET_BUFFERS = ('pkt_data', 'raw_data')
+# Options without a value that modify the content before them rather than
+# select a buffer
+CONTENT_FLAGS = ('nocase', 'fast_pattern', 'rawbytes')
+POSITION_MODIFIERS = ('offset', 'depth', 'distance', 'within')
+CONTENT_MODIFIERS = CONTENT_FLAGS + POSITION_MODIFIERS + ('fast_pattern_offset', 'fast_pattern_length')
+
+# pcre:"/regex/flags". Only i, s and m carry over to Hyperscan, x is applied
+# inline; the rest (R, A, E, G, O and the Snort 2 buffer flags) only narrow
+# where the rule engine looks and are dropped, which keeps the prefilter a
+# superset of the rule's matches
+PCRE = re.compile(r'^\s*(!?)\s*"?/(.*)/([A-Za-z]*)"?\s*$', re.S)
+PCRE_FLAGS = 'ism'
+# Flags placing the regex somewhere other than the start of the payload:
+# relative to the cursor, or in a Snort 2 HTTP/DCE buffer
+PCRE_ELSEWHERE = 'RUIPHDMCKSYB'
+# An anchor, only meaningful against the buffer the rule names
+ANCHOR = re.compile(r'(?<!\\)[$^]')
+# Every pcre is a prefilter (HS_FLAG_PREFILTER) reported once per packet
+# (HS_FLAG_SINGLEMATCH)
+REGEX_FLAGS = 'PH'
+
+def escape_literal(literal):
+    # Printable ASCII as is, every other byte (and '\\') as \xNN, which is
+    # what pcapscan's parseEscapedString decodes
+    return ''.join(chr(b) if 0x20 <= b < 0x7f and b != 0x5c else f'\\x{b:02x}' for b in literal)
 
 def write_pcre_to_file(pcre_dict, filename):
+    # id[,flags,min_offset,max_offset]:pattern. flags are Hyperscan's letters
+    # ('i' is HS_FLAG_CASELESS, 'P' HS_FLAG_PREFILTER marks a regex rather
+    # than an escaped literal), offsets bound where a match may end and are
+    # only written when the literal has one
     with open(filename, 'w') as file:
         for key, value in pcre_dict.items():
             pattern = value['string']#.strip('"')  # Strip quotes
-            file.write(f"{key}:{pattern}\n")
-
-strings = [] # strings extracted from rules
-string_table = {}
-rule_table = {}
-pattern = r'"([^"]*)"'
-r_id = 0
-count=0
-
-for rule in rule.parse_file(file):
-    if "content" in rule:
-        content_values = [option['value'] for option in rule['options'] if option['name'] == 'content']
+            header = str(key)
+            if value['min_offset'] or value['max_offset'] is not None:
+                header += f",{value['flags']},{value['min_offset']},{value['max_offset'] or ''}"
+            elif value['flags']:
+                header += f",{value['flags']}"
+            file.write(f"{header}:{pattern}\n")
+
+def convert_pcre(value, packet=True):
+    # Hyperscan (pattern, flags) for a pcre option, None for a negated or
+    # unreadable one, which the rule engine alone can check. So is an
+    # anchored regex applied anywhere but the start of the packet payload
+    # (packet False for a non-packet sticky buffer): '^' would never line up.
+    match = PCRE.match(value)
+    if not match or match.group(1):
+        return None
+    pattern, snort_flags = match.group(2), match.group(3)
+    if (not packet or any(f in PCRE_ELSEWHERE for f in snort_flags)) and ANCHOR.search(pattern):
+        return None
+    if 'x' in snort_flags:
+        pattern = '(?x)' + pattern
+    return pattern, REGEX_FLAGS + ''.join(f for f in PCRE_FLAGS if f in snort_flags)
+
+def apply_modifier(content, name, value=None):
+    if name in CONTENT_FLAGS:
+        content['mods'][name] = True
+    elif name in POSITION_MODIFIERS:
+        # A byte_extract variable instead of a number leaves it unknown
+        try:
+            content['mods'][name] = int(value)
+        except (TypeError, ValueError):
+            content['mods'][name] = None
+
+def end_bounds(length, mods, previous):
+    # (min, max) offset in the payload at which the content's match can end,
+    # max None when unbounded. previous is the bounds of the content a
+    # relative (distance/within) content follows, None when unknown.
+    if 'distance' in mods or 'within' in mods:
+        distance = mods.get('distance', 0)
+        within = mods.get('within')
+        if previous is None or distance is None:
+            return length, None
+        low = previous[0] + distance + length
+        high = None if within is None or previous[1] is None else previous[1] + distance + within
+    else:
+        offset = mods.get('offset', 0)
+        depth = mods.get('depth')
+        if offset is None:
+            return length, None
+        low = offset + length
+        high = None if depth is None else offset + depth
+    low = max(low, length)
+    if high is not None and high < low:
+        # Unsatisfiable as written, leave it to the rule engine
+        return length, None
+    return low, high
+
+def extract_rule(rul):
+    # The parts of a parsed rule string_gen needs, as plain picklable data.
+    # strings are (bytes, flags, min_offset, max_offset) literals, with
+    # min_offset 0 and max_offset None when unconstrained, and regexes the
+    # (pattern, flags) of its pcre options. fast_pattern is the index in
+    # strings of the content marked with the fast_pattern modifier (Snort 3
+    # inline or Snort 2 option), if any.
+    contents = []
+    regexes = []
+    buffer = 'pkt_data'
+    # Whether the cursor is still where the last content left it, so a
+    # relative content can be placed after it
+    follows = False
+    for option in rul['options']:
+        name, value = option['name'], option['value']
+        if name == 'content':
+            content = {'value': value, 'mods': {}, 'packet': buffer in PACKET_BUFFERS,
+                       'follows': follows}
+            match = CONTENT.search(value)
+            if match:
+                # Snort 3 modifiers follow the string inline: ,depth 4,nocase
+                for token in value[match.end():].split(','):
+                    if token.strip():
+                        apply_modifier(content, *token.split(None, 1))
+            contents.append(content)
+            follows = True
+        elif name == 'pcre':
+            regex = convert_pcre(value, buffer in PACKET_BUFFERS)
+            if regex and regex not in regexes:
+                regexes.append(regex)
+            follows = False
+        elif name in CONTENT_MODIFIERS:
+            # Snort 2 modifiers follow the content they apply to
+            if contents:
+                apply_modifier(contents[-1], name, value)
+        elif value is None:
+            # A buffer: sticky for the contents after it in Snort 3, a
+            # modifier of the content before it in Snort 2
+            buffer = name
+            if contents and name not in PACKET_BUFFERS:
+                contents[-1]['packet'] = False
+            follows = False
+        else:
+            follows = False
+
+    strings = []
+    fast_pattern = None
+    previous = None
+    for content in contents:
+        value = content['value']
+        mods = content['mods']
+        match = CONTENT.search(value)
+        # A negated content is not a literal the rule needs
+        if not match or value[:match.start()].strip().startswith('!'):
+            previous = None
+            continue
+        patt = match.group(1)
+        string = convert_format(patt)
+        if content['packet']:
+            previous = end_bounds(len(string), mods, previous if content['follows'] else None)
+            low, high = previous
+        else:
+            previous = None
+            low, high = len(string), None
+
+        if len(patt) > 1 and len(string) > 1:
+            nocase = bool(mods.get('nocase'))
+            if nocase:
+                string = string.lower()
+            if mods.get('fast_pattern'):
+                fast_pattern = len(strings)
+            strings.append((string, 'i' if nocase else '', low if low > len(string) else 0, high))
+    return {'sid': rul.sid, 'strings': strings, 'regexes': regexes, 'fast_pattern': fast_pattern,
+            'proto': rul.proto, 'src_port': rul.source_port, 'dst_port': rul.dest_port}
+
+def parse_chunk(lines):
+    return [extract_rule(rul) for rul in rule.parse_fileobj(lines)
+            if "content" in rul or "pcre" in rul]
+
+def rules_files(paths):
+    # Directories contribute their *.rules files, sorted, so the rule order
+    # (and with it every id) only depends on the paths given
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in sorted(os.walk(path)):
+                files.extend(os.path.join(root, name) for name in sorted(names)
+                             if name.endswith('.rules'))
+        else:
+            files.append(path)
+    return files
+
+def read_chunks(files, chunk_lines):
+    # Chunks of whole rules: never split after a line continued with '\\'
+    for name in files:
+        with open(name, encoding='utf-8') as f:
+            chunk = []
+            for line in f:
+                chunk.append(line)
+                if len(chunk) >= chunk_lines and not line.rstrip().endswith('\\'):
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+def parse_rules(files, workers, chunk_lines=CHUNK_LINES):
+    # Chunks are parsed in parallel but consumed in file order, so the
+    # records (and the ids given to them) do not depend on the worker count
+    chunks = read_chunks(files, chunk_lines)
+    if workers <= 1:
+        return [record for records in map(parse_chunk, chunks) for record in records]
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        return [record for records in pool.map(parse_chunk, chunks) for record in records]
+
+def build_tables(records):
+    # Identical literals are interned: every rule containing one shares its
+    # single str_id, so the literal is compiled and reported once. Literals
+    # only intern with the same modifiers. Regexes take str_ids from the same
+    # sequence, so a match id is a literal or a regex alike downstream.
+    strings = [] # strings extracted from rules
+    string_table = {}
+    rule_table = {}
+    literal_ids = {}
+    r_id = 0
+    count=0
+
+    def intern(key, string, entry):
+        nonlocal count
+        str_id = literal_ids.get(key)
+        if str_id is None:
+            count += 1
+            str_id = literal_ids[key] = count
+            strings.append(string)
+            entry.update(sids=[], rids=[])
+            string_table[str_id] = entry
+        return str_id
+
+    for record in records:
         r_id += 1
-        rule_table[r_id] = {'sid': rule.sid,
-                            'str_id': []}
-        for value in content_values:
-            match  = re.search(pattern, value)
-            patt = match.group(1)
-
-            if len(patt) > 1:
-                string = convert_format(patt)
-
-                if match and len(string) > 1:
-                    count += 1
-                    strings.append(string)
-                    string_table[count] = {'sid': rule.sid,
-                                          'string': str(string)[2:-1],
-                                          'rid': r_id}
-                    rule_table[r_id]['str_id'].append(count)
-with open('rule_table.json', 'w') as rule_file:
-    json.dump(rule_table, rule_file, indent=4)
-
-# Saving string_table to JSON file
-with open('string_table.json', 'w') as string_file:
-    json.dump(string_table, string_file, indent=4)
-                    
-write_pcre_to_file(string_table, 'literals.txt')
+        rule_table[r_id] = {'sid': record['sid'],
+                            'str_id': [],
+                            'fast_pattern': None,
+                            'proto': record['proto'],
+                            'src_port': record['src_port'],
+                            'dst_port': record['dst_port']}
+        str_ids = []
+        for i, literal in enumerate(record['strings']):
+            string, flags, min_offset, max_offset = literal
+            str_id = intern(literal, string, {'string': escape_literal(string),
+                                              'flags': flags,
+                                              'min_offset': min_offset,
+                                              'max_offset': max_offset,
+                                              'regex': False})
+            if i == record['fast_pattern']:
+                rule_table[r_id]['fast_pattern'] = str_id
+            str_ids.append(str_id)
+        for pattern, flags in record['regexes']:
+            str_ids.append(intern(('pcre', pattern, flags), pattern.encode('utf-8'),
+                                  {'string': pattern,
+                                   'flags': flags,
+                                   'min_offset': 0,
+                                   'max_offset': None,
+                                   'regex': True}))
+        for str_id in str_ids:
+            if str_id in rule_table[r_id]['str_id']:
+                continue
+            string_table[str_id]['sids'].append(record['sid'])
+            string_table[str_id]['rids'].append(r_id)
+            rule_table[r_id]['str_id'].append(str_id)
+    return rule_table, string_table, strings
+
+def write_outputs(rule_table, string_table, strings, vars_file=VARS_FILE):
+    # Rule and string ids are dense from 1, slot 0 of every table is unused
+    r_ids = range(1, len(rule_table) + 1)
+    fast_ids = select_fast_patterns(rule_table, string_table, strings)
+    write_ruleset('ruleset.bin',
+                  [0] + [rule_table[i]['sid'] for i in r_ids],
+                  [[]] + [rule_table[i]['str_id'] for i in r_ids],
+                  [b''] + strings,
+                  [0] + [rule_table[i]['fast'] or 0 for i in r_ids],
+                  [('', 0, None)] + [(entry['flags'], entry['min_offset'], entry['max_offset'])
+                                     for entry in string_table.values()])
+
+    write_pcre_to_file(string_table, 'literals.txt')
+    # Prefilter set for pcapscan -f, same ids as literals.txt
+    write_pcre_to_file({str_id: string_table[str_id] for str_id in sorted(fast_ids)},
+                       'fast_literals.txt')
+    write_groups(rule_table, string_table, vars_file)
+
+def write_groups(rule_table, string_table, vars_file=VARS_FILE):
+    # One literals file per port group (pcapscan -g), with the groups.json
+    # manifest naming each group's file, protocol, port intervals and rules.
+    # Port variables come from the same vars file the header engines read,
+    # so a widened HTTP_PORTS selects the HTTP group on the added ports too
+    groups = partition(rule_table, load_vars(vars_file).ports)
+    if os.path.isdir(GROUP_DIR):
+        shutil.rmtree(GROUP_DIR)
+    os.makedirs(GROUP_DIR)
+    for name, group in groups.items():
+        str_ids = sorted({str_id for r_id in group['rules'] for str_id in rule_table[r_id]['str_id']})
+        group['file'] = os.path.join(GROUP_DIR, name + '.txt')
+        write_pcre_to_file({str_id: string_table[str_id] for str_id in str_ids}, group['file'])
+    with open(MANIFEST, 'w') as f:
+        json.dump({'groups': groups}, f, indent=1)
+
+def cache_key(files, vars_file=VARS_FILE):
+    # Content address of a generation: the generator version plus the bytes
+    # of every rules file, in order, and of the vars file
+    digest = hashlib.sha256(f'string_gen {GENERATOR_VERSION}\n'.encode())
+    for name in files + [vars_file]:
+        digest.update(f'{os.path.getsize(name)}\n'.encode())
+        with open(name, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+def copy_output(src, dst):
+    # Outputs are files, except the directory of group literal files
+    if os.path.isdir(src):
+        if os.path.isdir(dst):
+            shutil.rmtree(dst)
+        shutil.copytree(src, dst)
+    else:
+        shutil.copyfile(src, dst)
+
+def restore_cached(key, cache_dir):
+    # Outputs already in place from this exact ruleset: nothing to do
+    if os.path.exists(STAMP) and all(os.path.exists(name) for name in OUTPUTS):
+        with open(STAMP, 'r') as f:
+            if f.read().strip() == key:
+                return True
+
+    entry = os.path.join(cache_dir, key)
+    if not all(os.path.exists(os.path.join(entry, name)) for name in OUTPUTS):
+        return False
+    for name in OUTPUTS:
+        copy_output(os.path.join(entry, name), name)
+    # mark it recently used, so prune_cache keeps it
+    os.utime(entry)
+    with open(STAMP, 'w') as f:
+        f.write(key + '\n')
+    return True
+
+def prune_cache(cache_dir, keep=CACHE_ENTRIES):
+    # Entries are named by their key (a sha256 hex digest); scratch
+    # directories of runs in progress are left alone
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+               if len(name) == 64 and all(c in '0123456789abcdef' for c in name)]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for entry in entries[keep:]:
+        shutil.rmtree(entry, ignore_errors=True)
+
+def store_cached(key, cache_dir):
+    # Copied into a scratch directory first so a concurrent run never sees a
+    # partially written entry
+    entry = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry):
+        os.makedirs(cache_dir, exist_ok=True)
+        scratch = tempfile.mkdtemp(dir=cache_dir)
+        for name in OUTPUTS:
+            copy_output(name, os.path.join(scratch, name))
+        try:
+            os.rename(scratch, entry)
+        except OSError:
+            shutil.rmtree(scratch)
+    else:
+        os.utime(entry)
+    prune_cache(cache_dir)
+    with open(STAMP, 'w') as f:
+        f.write(key + '\n')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compile a Snort ruleset into literals.txt and ruleset.bin')
+    parser.add_argument('rules', nargs='*', default=[file],
+                        help='rules files, or directories of *.rules files')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='processes parsing rules in parallel')
+    parser.add_argument('--cache-dir', default=CACHE_DIR,
+                        help='where compiled outputs are kept, keyed by rules file hash '
+                             f'(the {CACHE_ENTRIES} most recently used)')
+    parser.add_argument('--no-cache', action='store_true', help='always regenerate')
+    parser.add_argument('--vars', default=VARS_FILE,
+                        help='variables file the port groups resolve HTTP_PORTS etc. against')
+    args = parser.parse_args(argv)
+
+    files = rules_files(args.rules)
+    key = cache_key(files, args.vars)
+    if not args.no_cache and restore_cached(key, args.cache_dir):
+        print(f'{", ".join(files)} unchanged, using cached outputs ({key[:12]})')
+        return
+
+    # The outputs are about to change, drop the stamp until they are complete
+    if os.path.exists(STAMP):
+        os.remove(STAMP)
+    write_outputs(*build_tables(parse_rules(files, args.workers)), args.vars)
+    if not args.no_cache:
+        store_cached(key, args.cache_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# Batched header matching against the per-packet path, over a batch that
+# mixes IPv4 packets with IPv6 ones (whose addresses are None). Needs numpy.
+#   python -m unittest test_header_index
+import os
+import tempfile
+import unittest
+from hdr_match import RuleEngine
+from header_index import np
+
+RULES = '''\
+alert tcp 10.0.0.0/8 any -> any 80 (msg:"tcp from 10/8 to 80"; sid:1; rev:1;)
+alert tcp any any -> 192.168.1.1 445 (msg:"tcp to one host"; sid:2; rev:1;)
+alert udp any 53 -> any any (msg:"udp from 53"; sid:3; rev:1;)
+alert ip any any -> any any (msg:"any ip"; sid:4; rev:1;)
+'''
+
+def header(protocol, src_ip, src_port, dst_ip, dst_port):
+    return {'protocol': protocol, 'src_ip': src_ip, 'src_port': src_port,
+            'dst_ip': dst_ip, 'dst_port': dst_port}
+
+PACKETS = [
+    header('tcp', 0x0a000001, 1234, 0xc0a80101, 80),
+    header('tcp', None, 1234, None, 80),
+    header('tcp', 0x0b000001, 1234, 0xc0a80101, 445),
+    header('tcp', None, 1234, None, 445),
+    header('udp', None, 53, None, 5353),
+    header('udp', 0x08080808, 53, 0x0a000001, 5353),
+]
+
+@unittest.skipIf(np is None, 'numpy not installed')
+class MixedBatchTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.NamedTemporaryFile('w', suffix='.rules', delete=False) as f:
+            f.write(RULES)
+        try:
+            cls.engine = RuleEngine(f.name)
+        finally:
+            os.remove(f.name)
+
+    def test_batch_matches_per_packet(self):
+        sids, matrix = self.engine.header_matching_batch(PACKETS)
+        for pkt_hdr, row in zip(PACKETS, matrix):
+            matched, _ = self.engine.header_matching(pkt_hdr)
+            self.assertEqual({sid for sid, hit in zip(sids, row) if hit}, matched)
+
+    def test_ipv6_addresses_unchecked(self):
+        sids, matrix = self.engine.header_matching_batch(PACKETS)
+        rows = [{sid for sid, hit in zip(sids, row) if hit} for row in matrix]
+        self.assertEqual(rows[0], {1, 4})
+        self.assertEqual(rows[1], {1, 4})
+        self.assertEqual(rows[2], {2, 4})
+        self.assertEqual(rows[3], {2, 4})
+        self.assertEqual(rows[4], {3, 4})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# Round trip of literal bytes through literals.txt: string_gen escapes them,
+# hs_ctypes (like pcapscan) decodes and compiles them. The compile and scan
+# tests need libhs (see hs_ctypes.load_library) and are skipped without it.
+#   python -m unittest test_literals
+import os
+import tempfile
+import unittest
+from hs_ctypes import Database, HyperscanError, load_library, read_patterns, unescape
+from string_gen import escape_literal
+
+try:
+    load_library()
+    HAVE_LIBHS = True
+except OSError:
+    HAVE_LIBHS = False
+
+ALL_NUL = b'\x00\x00\x00\x00'
+LEADING_BACKSLASH = b'\\x'
+
+class EscapeTest(unittest.TestCase):
+    def test_round_trip(self):
+        for literal in (ALL_NUL, LEADING_BACKSLASH, b'\x00\\\x00|abc', bytes(range(256))):
+            self.assertEqual(unescape(escape_literal(literal).encode()), literal)
+
+    def test_read_patterns(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+            f.write(f'1:{escape_literal(ALL_NUL)}\n')
+            f.write(f'2,i,0,8:{escape_literal(LEADING_BACKSLASH)}\n')
+        try:
+            patterns = read_patterns(f.name)
+        finally:
+            os.remove(f.name)
+        self.assertEqual(patterns, [(1, ALL_NUL, 0, 0, None), (2, LEADING_BACKSLASH, 1, 0, 8)])
+
+@unittest.skipUnless(HAVE_LIBHS, 'libhs not found')
+class ScanTest(unittest.TestCase):
+    def scan(self, patterns, data):
+        database = Database(patterns)
+        scanner = database.scanner()
+        try:
+            return scanner.scan(data)
+        finally:
+            scanner.close()
+            database.close()
+
+    def test_literal_compiler(self):
+        patterns = [(1, ALL_NUL, 0, 0, None), (2, b'abc', 0, 0, None)]
+        try:
+            Database(patterns[:1]).close()
+        except HyperscanError as error:
+            # an upstream libhs tests literals for emptiness with strcmp
+            if 'empty string' not in str(error):
+                raise
+            self.skipTest('libhs rejects literals starting with NUL')
+        self.assertEqual(self.scan(patterns, b'ab\x00\x00\x00\x00c'), [1])
+        self.assertEqual(self.scan(patterns, b'\x00\x00\x00abc'), [2])
+
+    def test_ext_compiler(self):
+        # offset bounds take the hs_compile_ext_multi path, where an empty
+        # literal would fail to compile
+        patterns = [(1, ALL_NUL, 0, 0, None), (2, LEADING_BACKSLASH, 1, 0, 4)]
+        self.assertEqual(self.scan(patterns, b'\\X\x00\x00\x00\x00'), [1, 2])
+        self.assertEqual(self.scan(patterns, b'....\\x\x00\x00\x00'), [])
+
+if __name__ == '__main__':
+    unittest.main()
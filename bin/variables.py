@@ -0,0 +1,117 @@
+# variables
+#
+# Network and port variables (HOME_NET, HTTP_PORTS, ...) for HDREngine and
+# RuleEngine, read from a vars file and compiled once into interval sets:
+#
+#   snort.lua    HOME_NET = '192.168.0.0/16'
+#                HTTP_PORTS = [[ 80 81 8080 ]]
+#                FILE_DATA_PORTS = HTTP_PORTS .. ' 110 143'
+#   snort.conf   ipvar HOME_NET [192.168.0.0/16]
+#                portvar HTTP_PORTS [80,81,8080]
+#   YAML         vars:
+#                  address-groups:
+#                    HOME_NET: "[192.168.0.0/16]"
+#                  port-groups:
+#                    HTTP_PORTS: "[80,81,8080]"
+#
+# In the Lua form a name ending in _PORTS is a port variable and anything
+# else an address variable. Values may be space separated lists, as in
+# Snort 3's snort_defaults.lua.
+import functools
+import os
+import re
+from addresses import parse_addresses
+from ports import parse_ports
+
+VARS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snort_vars.lua')
+
+STRING = r"'[^']*'|\"[^\"]*\"|\[\[.*?\]\]|[A-Za-z_]\w*"
+ASSIGN = re.compile(rf"^[ \t]*([A-Za-z_]\w*)[ \t]*=\s*((?:{STRING})(?:\s*\.\.\s*(?:{STRING}))*)",
+                    re.M | re.S)
+PART = re.compile(r"'([^']*)'|\"([^\"]*)\"|\[\[(.*?)\]\]|([A-Za-z_]\w*)", re.S)
+DECLARE = re.compile(r'^\s*(ipvar|portvar|var)\s+(\w+)\s+(.+?)\s*$', re.M)
+
+def to_spec(value):
+    # '80 81 8080' -> '[80,81,8080]'; specs already in rule syntax pass
+    tokens = value.split()
+    if len(tokens) == 1:
+        return tokens[0]
+    if value.strip().startswith('['):
+        return value.strip()
+    return '[' + ','.join(tokens) + ']'
+
+def parse_lua(text):
+    text = re.sub(r'--.*', '', text)
+    values = {}
+    for name, expression in ASSIGN.findall(text):
+        parts = []
+        for single, double, long, reference in PART.findall(expression):
+            if reference:
+                if reference not in values:
+                    # not a string assignment (numbers, tables, ...)
+                    break
+                parts.append(values[reference])
+            else:
+                parts.append(single or double or long)
+        else:
+            values[name] = ' '.join(parts)
+    ip_vars = {}
+    port_vars = {}
+    for name, value in values.items():
+        target = port_vars if name.endswith('_PORTS') else ip_vars
+        target[name] = to_spec(value)
+    for keyword, name, value in DECLARE.findall(text):
+        target = port_vars if keyword == 'portvar' or name.endswith('_PORTS') else ip_vars
+        target[name] = to_spec(value)
+    return ip_vars, port_vars
+
+def parse_yaml(text):
+    # Only the keys nested under vars: address-groups: and vars: port-groups:
+    # are read; the rest of a suricata.yaml is skipped by indentation
+    groups = {('vars', 'address-groups'): {}, ('vars', 'port-groups'): {}}
+    path = []
+    for line in text.splitlines():
+        line = line.split('#', 1)[0].rstrip()
+        if not line.strip() or line.startswith(('%', '---')):
+            continue
+        indent = len(line) - len(line.lstrip())
+        key, _, value = line.strip().partition(':')
+        value = value.strip().strip('"\'')
+        while path and path[-1][0] >= indent:
+            path.pop()
+        target = groups.get(tuple(name for _, name in path))
+        if target is not None and value:
+            target[key.strip()] = to_spec(value)
+        path.append((indent, key.strip()))
+    return groups[('vars', 'address-groups')], groups[('vars', 'port-groups')]
+
+class Variables:
+    def __init__(self, ip_vars, port_vars):
+        self.ip_vars = ip_vars
+        self.port_vars = port_vars
+        # Resolved against each other once; parse_addresses and parse_ports
+        # take these interval sets in place of spec strings
+        self.addresses = {}
+        for name, spec in ip_vars.items():
+            try:
+                self.addresses[name] = parse_addresses(spec, ip_vars)
+            except ValueError:
+                # IPv6 or otherwise unusable: left out, so rules using it
+                # are unconstrained on that side
+                pass
+        self.ports = {}
+        for name, spec in port_vars.items():
+            try:
+                self.ports[name] = parse_ports(spec, port_vars)
+            except ValueError:
+                # likewise: rules using it are unconstrained on that port
+                pass
+
+@functools.lru_cache(maxsize=None)
+def load_vars(path=VARS_FILE):
+    # One compiled Variables per file, shared by every engine in the process
+    with open(path, 'r') as f:
+        text = f.read()
+    if path.endswith(('.yaml', '.yml')):
+        return Variables(*parse_yaml(text))
+    return Variables(*parse_lua(text))
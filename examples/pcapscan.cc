@@ -37,11 +37,16 @@
  *
  * Build instructions:
  *
- *     g++ -std=c++11 -O2 -o pcapscan pcapscan.cc $(pkg-config --cflags --libs libhs) -lpcap
+ *     g++ -std=c++11 -O2 -I../bin -o pcapscan pcapscan.cc $(pkg-config --cflags --libs libhs) -lpcap
  *
  * Usage:
  *
- *     ./pcapscan [-n repeats] <pattern file> <pcap file>
+ *     ./pcapscan [-n repeats] [-f fast pattern file [-r ruleset]] [-g groups.json] <pattern file> <pcap file>
+ *
+ * With -f, each packet is scanned for the rules' fast patterns first, and
+ * for the other literals only when one of them hit. A hit on one of those is
+ * reported only if a rule it belongs to (looked up in string_gen's
+ * ruleset.bin) had its fast pattern hit too.
  *
  * We recommend the use of a utility like 'taskset' on multiprocessor hosts to
  * pin execution to a single processor: this will remove processor migration
@@ -55,6 +60,7 @@
 #include <fstream>
 #include <iomanip>
 #include <iostream>
+#include <memory>
 #include <string>
 #include <unordered_map>
 #include <vector>
@@ -83,6 +89,8 @@
 
 #include <hs.h>
 
+#include "ruleset.hpp"
+
 using std::cerr;
 using std::cout;
 using std::endl;
@@ -122,6 +130,29 @@ struct FiveTuple {
     }
 };
 
+// A port group from string_gen's groups.json, with its own database. A
+// packet is scanned against it when of its protocol (-1 for any) with either
+// port in one of its intervals.
+struct PortGroup {
+    int protocol;
+    vector<std::pair<unsigned int, unsigned int>> ports;
+    hs_database_t *db;
+
+    bool selects(const FiveTuple &ft) const {
+        if (protocol >= 0 && (unsigned int)protocol != ft.protocol) {
+            return false;
+        }
+        unsigned int src = ntohs(ft.srcPort), dst = ntohs(ft.dstPort);
+        for (const auto &range : ports) {
+            if ((src >= range.first && src <= range.second) ||
+                (dst >= range.first && dst <= range.second)) {
+                return true;
+            }
+        }
+        return false;
+    }
+};
+
 // A *very* simple hash function, used when we create an unordered_map of
 // FiveTuple objects.
 struct FiveTupleHash {
@@ -185,6 +216,19 @@ private:
     // Hyperscan compiled database (block mode)
     const hs_database_t *db_block;
 
+    // Optional block mode database of fast patterns only. When set, a packet
+    // is scanned against db_block (then holding the other literals) only if
+    // one of them matched.
+    const hs_database_t *db_prefilter;
+
+    // With db_prefilter: the rules each literal belongs to and their fast
+    // patterns
+    const Ruleset *ruleset;
+
+    // Optional port groups. When set, a packet is scanned against the groups
+    // its 5-tuple selects instead of db_block.
+    const vector<PortGroup> *groups;
+
     // Hyperscan temporary scratch space (used in both modes)
     hs_scratch_t *scratch;
 
@@ -196,12 +240,26 @@ private:
 
     int count = 0;
     std::set<int> currentMatchIds;
-    std::unordered_map<int, std::set<int>> packetIdToMatchIds;
+    std::set<int> fastMatchIds;
+
+    // Whether a rule of the literal had its fast pattern hit
+    bool fastPatternHit(int strId) const {
+        auto rules = ruleset->stringRules(strId);
+        for (const uint32_t *rule = rules.first; rule != rules.second; ++rule) {
+            if (fastMatchIds.count(ruleset->fastPattern(*rule))) {
+                return true;
+            }
+        }
+        return false;
+    }
 
 public:
-    Benchmark(const hs_database_t *streaming, const hs_database_t *block)
-        : db_streaming(streaming), db_block(block), scratch(nullptr),
-          matchCount(0) {
+    Benchmark(const hs_database_t *streaming, const hs_database_t *block,
+              const hs_database_t *prefilter = nullptr,
+              const vector<PortGroup> *portGroups = nullptr,
+              const Ruleset *rules = nullptr)
+        : db_streaming(streaming), db_block(block), db_prefilter(prefilter),
+          ruleset(rules), groups(portGroups), scratch(nullptr), matchCount(0) {
         // Allocate enough scratch space to handle either streaming or block
         // mode, so we only need the one scratch region.
         // hs_error_t err = hs_alloc_scratch(db_streaming, &scratch);
@@ -211,11 +269,33 @@ public:
         // }
         // This second call will increase the scratch size if more is required
         // for block mode.
-        hs_error_t err = hs_alloc_scratch(db_block, &scratch);
+        hs_error_t err = HS_SUCCESS;
+        if (db_block) {
+            err = hs_alloc_scratch(db_block, &scratch);
+        }
         if (err != HS_SUCCESS) {
             cerr << "ERROR: could not allocate scratch space. Exiting." << endl;
             exit(-1);
         }
+        if (db_prefilter) {
+            err = hs_alloc_scratch(db_prefilter, &scratch);
+            if (err != HS_SUCCESS) {
+                cerr << "ERROR: could not allocate scratch space. Exiting." << endl;
+                exit(-1);
+            }
+        }
+        if (groups) {
+            for (const auto &group : *groups) {
+                if (!group.db) {
+                    continue;
+                }
+                err = hs_alloc_scratch(group.db, &scratch);
+                if (err != HS_SUCCESS) {
+                    cerr << "ERROR: could not allocate scratch space. Exiting." << endl;
+                    exit(-1);
+                }
+            }
+        }
     }
 
     ~Benchmark() {
@@ -257,34 +337,9 @@ public:
         }
         pcap_close(pcapHandle);
 
-        writeFiveTuplesToJson("five_tuples.json");
-
         return !packets.empty();
     }
 
-    void writeFiveTuplesToJson(const std::string& filename) {
-        json j;
-        for (size_t i = 0; i < fiveTuples.size(); ++i) {
-            const FiveTuple& ft = fiveTuples[i];
-            j[std::to_string(i)] = {
-                {"protocol", ft.protocol},
-                {"srcAddr", ft.srcAddr},
-                {"srcPort", ft.srcPort},
-                {"dstAddr", ft.dstAddr},
-                {"dstPort", ft.dstPort}
-            };
-        }
-
-        std::ofstream outFile(filename);
-        if (outFile.is_open()) {
-            outFile << j.dump(4); // Pretty-print JSON with an indent of 4 spaces
-            outFile.close();
-            std::cout << "FiveTuples saved to " << filename << std::endl;
-        } else {
-            std::cerr << "ERROR: Unable to open file " << filename << std::endl;
-        }
-    }
-
     // Return the number of bytes scanned
     size_t bytes() const {
         size_t sum = 0;
@@ -318,51 +373,79 @@ public:
 
    
     // Scan each packet (in the ordering given in the PCAP file) through
-    // Hyperscan using the block-mode interface.
+    // Hyperscan using the block-mode interface. Each packet's matched ids are
+    // written out as soon as it is scanned, with its 5-tuple (addresses and
+    // ports in host byte order), one JSON array per line:
+    // [packet id, [id, ...], {"protocol", "srcAddr", "srcPort", "dstAddr", "dstPort"}]
     void scanBlock() {
-        size_t prev_count;
+        std::ofstream outputFile("matched_ids.jsonl");
         for (size_t i = 0; i != packets.size(); ++i) {
-            prev_count = matchCount;
-            // std::this_thread::sleep_for(std::chrono::milliseconds(100));
-            // cout << "\nreading packet " << i << std::endl;
-            // std::this_thread::sleep_for(std::chrono::milliseconds(1000));
-
             const std::string &pkt = packets[i];
 
-            // cout << "payload: " << pkt;
-            hs_error_t err = hs_scan(db_block, pkt.c_str(), pkt.length(), 0,
-                                     scratch, onMatch, &currentMatchIds);
+            // No fast pattern hit: no rule can be confirmed on this packet,
+            // so its other literals need not be looked for
+            bool skip = false;
+            if (db_prefilter) {
+                hs_error_t err = hs_scan(db_prefilter, pkt.c_str(), pkt.length(), 0,
+                                         scratch, onMatch, &fastMatchIds);
+                if (err != HS_SUCCESS) {
+                    cerr << "ERROR: Unable to scan packet. Exiting." << endl;
+                    exit(-1);
+                }
+                skip = fastMatchIds.empty();
+            }
+
+            hs_error_t err = HS_SUCCESS;
+            if (!skip && groups) {
+                for (const auto &group : *groups) {
+                    if (!group.db || !group.selects(fiveTuples[i])) {
+                        continue;
+                    }
+                    err = hs_scan(group.db, pkt.c_str(), pkt.length(), 0,
+                                  scratch, onMatch, &currentMatchIds);
+                    if (err != HS_SUCCESS) {
+                        break;
+                    }
+                }
+            } else if (!skip && db_block) {
+                err = hs_scan(db_block, pkt.c_str(), pkt.length(), 0,
+                              scratch, onMatch, &currentMatchIds);
+            }
             if (err != HS_SUCCESS) {
                 cerr << "ERROR: Unable to scan packet. Exiting." << endl;
                 exit(-1);
             }
 
-            // for (int x : currentMatchIds){
-            //     std::cout << x << " " ;
-            // }
-            // std::cout << std::endl;  
-            packetIdToMatchIds[i].insert(currentMatchIds.begin(), currentMatchIds.end());
-            currentMatchIds.clear();
-        }
-        std::ofstream outputFile("matched_ids.json");
-        outputFile << "{"; // Start JSON object
-        for (size_t i = 0; i < packetIdToMatchIds.size(); ++i) {
-            outputFile << "\"" << i << "\": ["; // Key (packet ID) and start of array
-            for (auto it = packetIdToMatchIds[i].begin(); it != packetIdToMatchIds[i].end(); ++it) {
-                outputFile << *it;
-                if (std::next(it) != packetIdToMatchIds[i].end()) {
-                    outputFile << ",";
+            // A rule's other literals only count where its fast pattern hit
+            if (db_prefilter) {
+                for (auto it = currentMatchIds.begin(); it != currentMatchIds.end();) {
+                    if (fastPatternHit(*it)) {
+                        ++it;
+                    } else {
+                        it = currentMatchIds.erase(it);
+                    }
                 }
+                currentMatchIds.insert(fastMatchIds.begin(), fastMatchIds.end());
+                fastMatchIds.clear();
             }
-            outputFile << "]"; // End of array
-            if (i < packetIdToMatchIds.size() - 1) {
-                outputFile << ",";
+
+            outputFile << "[" << i << ",[";
+            for (auto it = currentMatchIds.begin(); it != currentMatchIds.end(); ++it) {
+                if (it != currentMatchIds.begin()) {
+                    outputFile << ",";
+                }
+                outputFile << *it;
             }
+            const FiveTuple &ft = fiveTuples[i];
+            outputFile << "],{\"protocol\":" << ft.protocol
+                       << ",\"srcAddr\":" << ntohl(ft.srcAddr)
+                       << ",\"srcPort\":" << ntohs(ft.srcPort)
+                       << ",\"dstAddr\":" << ntohl(ft.dstAddr)
+                       << ",\"dstPort\":" << ntohs(ft.dstPort) << "}]\n";
+            currentMatchIds.clear();
         }
-        outputFile << "}"; // End JSON object
         outputFile.close();
-        std::cout << "Packet IDs and matched string IDs saved to matched_ids.json" << std::endl;
-        
+        std::cout << "Packet IDs and matched string IDs saved to matched_ids.jsonl" << std::endl;
     }
 
     // Display some information about the compiled database and scanned data.
@@ -413,16 +496,19 @@ public:
 
 // helper function - see end of file
 string parseEscapedString(string s);
-std::string rmnullsuff(std::string s);
+static string escapeLiteral(const char *s, size_t len);
+static unsigned parseFlags(const string &flagsStr);
 
 static void parseFile(const char *filename, vector<string> &patterns,
-                      vector<unsigned> &flags, vector<unsigned> &ids, vector<size_t> &lens);
+                      vector<unsigned> &flags, vector<unsigned> &ids, vector<size_t> &lens,
+                      vector<hs_expr_ext_t> &exts);
 
 
 static hs_database_t *buildDatabase(const vector<const char *> &expressions,
                                     const vector<unsigned> flags,
                                     const vector<unsigned> ids,
                                     const vector<size_t> lens,
+                                    const vector<hs_expr_ext_t> &exts,
                                     unsigned int mode) {
     hs_database_t *db;
     hs_compile_error_t *compileErr;
@@ -431,11 +517,62 @@ static hs_database_t *buildDatabase(const vector<const char *> &expressions,
     Clock clock;
     clock.start();
 
-    // err = hs_compile_multi(expressions.data(), flags.data(), ids.data(),
-    //                        expressions.size(), mode, nullptr, &db, &compileErr);
-    err = hs_compile_lit_multi(expressions.data(), NULL, ids.data(), lens.data(), 
-                            expressions.size(), mode, NULL,
-                            &db, &compileErr);
+    // Offset bounds (from depth, offset, distance and within) are extended
+    // parameters and pcres (HS_FLAG_PREFILTER) are regexes, neither of which
+    // the literal compiler takes. With any of them, every literal is
+    // compiled as a regex of \xNN escapes instead.
+    bool literal = true;
+    for (size_t i = 0; i < expressions.size(); i++) {
+        if (exts[i].flags || (flags[i] & HS_FLAG_PREFILTER)) {
+            literal = false;
+            break;
+        }
+    }
+
+    if (literal) {
+        // err = hs_compile_multi(expressions.data(), flags.data(), ids.data(),
+        //                        expressions.size(), mode, nullptr, &db, &compileErr);
+        err = hs_compile_lit_multi(expressions.data(), flags.data(), ids.data(), lens.data(), 
+                                expressions.size(), mode, NULL,
+                                &db, &compileErr);
+    } else {
+        vector<string> regexes;
+        vector<const char *> cstrRegexes;
+        vector<unsigned> regexFlags(flags);
+        vector<hs_expr_ext_t> regexExts(exts);
+        vector<const hs_expr_ext_t *> extPtrs;
+        for (size_t i = 0; i < expressions.size(); i++) {
+            if (flags[i] & HS_FLAG_PREFILTER) {
+                regexes.push_back(expressions[i]);
+            } else {
+                regexes.push_back(escapeLiteral(expressions[i], lens[i]));
+            }
+        }
+        for (size_t i = 0; i < expressions.size(); i++) {
+            cstrRegexes.push_back(regexes[i].c_str());
+            extPtrs.push_back(&regexExts[i]);
+        }
+
+        while (true) {
+            err = hs_compile_ext_multi(cstrRegexes.data(), regexFlags.data(), ids.data(),
+                                       extPtrs.data(), expressions.size(), mode,
+                                       NULL, &db, &compileErr);
+            if (err == HS_SUCCESS || compileErr->expression < 0 ||
+                !(regexFlags[compileErr->expression] & HS_FLAG_PREFILTER)) {
+                break;
+            }
+            // Even prefilter mode rejects some pcre constructs. The rule
+            // still needs the id reported, so the pcre is replaced by an
+            // empty pattern that matches every packet.
+            int bad = compileErr->expression;
+            cerr << "WARNING: Pattern '" << expressions[bad]
+                 << "' failed compilation with error: " << compileErr->message
+                 << ", matching every packet instead" << endl;
+            hs_free_compile_error(compileErr);
+            cstrRegexes[bad] = "";
+            regexFlags[bad] = HS_FLAG_ALLOWEMPTY;
+        }
+    }
 
     clock.stop();
 
@@ -469,7 +606,8 @@ static hs_database_t *buildDatabase(const vector<const char *> &expressions,
  */
 static void databasesFromFile(const char *filename,
                               hs_database_t **db_streaming,
-                              hs_database_t **db_block) {
+                              hs_database_t **db_block,
+                              const vector<char> *exclude = nullptr) {
     // hs_compile_multi requires three parallel arrays containing the patterns,
     // flags and ids that we want to work with. To achieve this we use
     // vectors and new entries onto each for each valid line of input from
@@ -478,9 +616,37 @@ static void databasesFromFile(const char *filename,
     vector<unsigned> flags;
     vector<unsigned> ids;
     vector<size_t> lens;
+    vector<hs_expr_ext_t> exts;
 
     // do the actual file reading and string handling
-    parseFile(filename, patterns, flags, ids, lens);
+    parseFile(filename, patterns, flags, ids, lens, exts);
+
+    // Leave out the ids another database scans for (the fast patterns)
+    if (exclude) {
+        size_t kept = 0;
+        for (size_t i = 0; i < ids.size(); i++) {
+            if (ids[i] < exclude->size() && (*exclude)[ids[i]]) {
+                continue;
+            }
+            patterns[kept] = std::move(patterns[i]);
+            flags[kept] = flags[i];
+            ids[kept] = ids[i];
+            lens[kept] = lens[i];
+            exts[kept] = exts[i];
+            kept++;
+        }
+        patterns.resize(kept);
+        flags.resize(kept);
+        ids.resize(kept);
+        lens.resize(kept);
+        exts.resize(kept);
+    }
+
+    if (patterns.empty()) {
+        // Nothing to match, e.g. a port group whose rules have no literals
+        *db_block = nullptr;
+        return;
+    }
 
     // Turn our vector of strings into a vector of char*'s to pass in to
     // hs_compile_multi. (This is just using the vector of strings as dynamic
@@ -494,25 +660,71 @@ static void databasesFromFile(const char *filename,
          << " patterns." << endl;
 
     // *db_streaming = buildDatabase(cstrPatterns, flags, ids, HS_MODE_STREAM);
-    *db_block = buildDatabase(cstrPatterns, flags, ids, lens, HS_MODE_BLOCK);
+    *db_block = buildDatabase(cstrPatterns, flags, ids, lens, exts, HS_MODE_BLOCK);
 
 }
 
+/**
+ * Read string_gen's groups.json manifest and build a block mode database for
+ * each port group's literals file.
+ */
+static vector<PortGroup> groupsFromFile(const char *filename,
+                                        const vector<char> *exclude = nullptr) {
+    ifstream inFile(filename);
+    if (!inFile.good()) {
+        cerr << "ERROR: Can't open groups file \"" << filename << "\"" << endl;
+        exit(-1);
+    }
+    json manifest = json::parse(inFile);
+
+    vector<PortGroup> groups;
+    for (const auto &item : manifest["groups"].items()) {
+        const json &entry = item.value();
+        PortGroup group;
+        string protocol = entry["protocol"];
+        group.protocol = protocol == "tcp" ? IPPROTO_TCP
+                       : protocol == "udp" ? IPPROTO_UDP
+                       : protocol == "icmp" ? IPPROTO_ICMP : -1;
+        for (const auto &range : entry["ports"]) {
+            group.ports.push_back(std::make_pair(range[0].get<unsigned int>(),
+                                                 range[1].get<unsigned int>()));
+        }
+        string file = entry["file"];
+        hs_database_t *db_streaming = nullptr;
+        cout << "Port group " << item.key() << ": " << file << endl;
+        databasesFromFile(file.c_str(), &db_streaming, &group.db, exclude);
+        groups.push_back(group);
+    }
+    return groups;
+}
+
 static void usage(const char *prog) {
-    cerr << "Usage: " << prog << " [-n repeats] <pattern file> <pcap file>" << endl;
+    cerr << "Usage: " << prog << " [-n repeats] [-f fast pattern file [-r ruleset]] [-g groups.json] <pattern file> <pcap file>" << endl;
 }
 
 // Main entry point.
 int main(int argc, char **argv) {
     unsigned int repeatCount = 1;
+    const char *fastPatternFile = nullptr;
+    const char *rulesetFile = "ruleset.bin";
+    const char *groupsFile = nullptr;
 
     // Process command line arguments.
     int opt;
-    while ((opt = getopt(argc, argv, "n:")) != -1) {
+    while ((opt = getopt(argc, argv, "n:f:r:g:")) != -1) {
         switch (opt) {
         case 'n':
             repeatCount = atoi(optarg);
             break;
+        case 'f':
+            fastPatternFile = optarg;
+            break;
+        case 'r':
+            rulesetFile = optarg;
+            break;
+        case 'g':
+            groupsFile = optarg;
+            break;
         default:
             usage(argv[0]);
             exit(-1);
@@ -527,13 +739,43 @@ int main(int argc, char **argv) {
     const char *patternFile = argv[optind];
     const char *pcapFile = argv[optind + 1];
 
+    // Fast patterns (string_gen's fast_literals.txt) prefilter the full scan,
+    // which then leaves them out
+    hs_database_t *db_prefilter_streaming = nullptr, *db_prefilter = nullptr;
+    std::unique_ptr<Ruleset> ruleset;
+    vector<char> fastIds;
+    if (fastPatternFile) {
+        cout << "Fast pattern file: " << fastPatternFile << endl;
+        try {
+            ruleset.reset(new Ruleset(rulesetFile));
+        } catch (const std::exception &e) {
+            cerr << "ERROR: " << e.what() << endl;
+            exit(-1);
+        }
+        fastIds.assign(ruleset->numStrings(), 0);
+        for (uint32_t ruleId = 1; ruleId < ruleset->numRules(); ++ruleId) {
+            fastIds[ruleset->fastPattern(ruleId)] = 1;
+        }
+        fastIds[0] = 0;
+        databasesFromFile(fastPatternFile, &db_prefilter_streaming, &db_prefilter);
+    }
+    const vector<char> *exclude = fastPatternFile ? &fastIds : nullptr;
+
     // Read our pattern set in and build Hyperscan databases from it.
     cout << "Pattern file: " << patternFile << endl;
-    hs_database_t *db_streaming, *db_block;
-    databasesFromFile(patternFile, &db_streaming, &db_block);
+    hs_database_t *db_streaming = nullptr, *db_block = nullptr;
+    databasesFromFile(patternFile, &db_streaming, &db_block, exclude);
+
+    // Port groups (string_gen's groups.json) replace the single database
+    vector<PortGroup> groups;
+    if (groupsFile) {
+        cout << "Groups file: " << groupsFile << endl;
+        groups = groupsFromFile(groupsFile, exclude);
+    }
 
     // Read our input PCAP file in
-    Benchmark bench(db_streaming, db_block);
+    Benchmark bench(db_streaming, db_block, db_prefilter,
+                    groupsFile ? &groups : nullptr, ruleset.get());
     cout << "PCAP input file: " << pcapFile << endl;
     if (!bench.readStreams(pcapFile)) {
         cerr << "Unable to read packets from PCAP file. Exiting." << endl;
@@ -622,6 +864,11 @@ int main(int argc, char **argv) {
     // Close Hyperscan databases
     hs_free_database(db_streaming);
     hs_free_database(db_block);
+    hs_free_database(db_prefilter_streaming);
+    hs_free_database(db_prefilter);
+    for (auto &group : groups) {
+        hs_free_database(group.db);
+    }
 
     return 0;
 }
@@ -668,52 +915,47 @@ static bool payloadOffset(const unsigned char *pkt_data, unsigned int *offset,
     return *length != 0;
 }
 
-// static unsigned parseFlags(const string &flagsStr) {
-//     unsigned flags = 0;
-//     for (const auto &c : flagsStr) {
-//         switch (c) {
-//         case 'i':
-//             flags |= HS_FLAG_CASELESS; break;
-//         case 'm':
-//             flags |= HS_FLAG_MULTILINE; break;
-//         case 's':
-//             flags |= HS_FLAG_DOTALL; break;
-//         case 'H':
-//             flags |= HS_FLAG_SINGLEMATCH; break;
-//         case 'V':
-//             flags |= HS_FLAG_ALLOWEMPTY; break;
-//         case '8':
-//             flags |= HS_FLAG_UTF8; break;
-//         case 'W':
-//             flags |= HS_FLAG_UCP; break;
-//         case '\r': // stray carriage-return
-//             break;
-//         default:
-//             cerr << "Unsupported flag \'" << c << "\'" << endl;
-//             exit(-1);
-//         }
-//     }
-//     return flags;
-// }
-
-std::string rmnullsuff(std::string s)
-{
-    std::string result;
-    int flag = 0;
-    std::istringstream stream(s);
-    char c;
-
-    // Skip all leading null characters (\x00)
-    while (stream.get(c)) {
-        if ((c == '\x00' || c == '\\') && flag == 0) {
-            continue; // Stop skipping when a non-null character is found
-        }
-        else
-        {
-            flag = 1;
-            result.push_back(c);
+static unsigned parseFlags(const string &flagsStr) {
+    unsigned flags = 0;
+    for (const auto &c : flagsStr) {
+        switch (c) {
+        case 'i':
+            flags |= HS_FLAG_CASELESS; break;
+        case 'm':
+            flags |= HS_FLAG_MULTILINE; break;
+        case 's':
+            flags |= HS_FLAG_DOTALL; break;
+        case 'H':
+            flags |= HS_FLAG_SINGLEMATCH; break;
+        case 'V':
+            flags |= HS_FLAG_ALLOWEMPTY; break;
+        case '8':
+            flags |= HS_FLAG_UTF8; break;
+        case 'W':
+            flags |= HS_FLAG_UCP; break;
+        case 'P':
+            flags |= HS_FLAG_PREFILTER; break;
+        case '\r': // stray carriage-return
+            break;
+        default:
+            cerr << "Unsupported flag \'" << c << "\'" << endl;
+            exit(-1);
         }
     }
+    return flags;
+}
+
+// Literal bytes as a regex matching exactly them
+static string escapeLiteral(const char *s, size_t len) {
+    static const char hex[] = "0123456789abcdef";
+    string result;
+    result.reserve(len * 4);
+    for (size_t i = 0; i < len; i++) {
+        unsigned char c = s[i];
+        result += "\\x";
+        result += hex[c >> 4];
+        result += hex[c & 0xf];
+    }
     return result;
 }
 
@@ -747,12 +989,13 @@ string parseEscapedString(string s) {
         }
     }
 
-    return rmnullsuff(result);
+    return result;
 }
 
 
 static void parseFile(const char *filename, vector<string> &patterns,
-                      vector<unsigned> &flags, vector<unsigned> &ids, vector<size_t> &lens) {
+                      vector<unsigned> &flags, vector<unsigned> &ids, vector<size_t> &lens,
+                      vector<hs_expr_ext_t> &exts) {
     ifstream inFile(filename);
     if (!inFile.good()) {
         cerr << "ERROR: Can't open pattern file \"" << filename << "\"" << endl;
@@ -773,17 +1016,38 @@ static void parseFile(const char *filename, vector<string> &patterns,
             exit(-1);
         }
 
-        unsigned id = std::stoi(line.substr(0, colonIdx).c_str());
+        // id[,flags[,min_offset,max_offset]] precede the pattern. The
+        // offsets bound where a match may end, empty for no bound.
+        vector<string> fields;
+        std::istringstream header(line.substr(0, colonIdx));
+        string field;
+        while (getline(header, field, ',')) {
+            fields.push_back(field);
+        }
+        unsigned id = std::stoi(fields[0].c_str());
+        hs_expr_ext_t ext{};
+        if (fields.size() > 2 && !fields[2].empty() && std::stoull(fields[2]) != 0) {
+            ext.flags |= HS_EXT_FLAG_MIN_OFFSET;
+            ext.min_offset = std::stoull(fields[2]);
+        }
+        if (fields.size() > 3 && !fields[3].empty()) {
+            ext.flags |= HS_EXT_FLAG_MAX_OFFSET;
+            ext.max_offset = std::stoull(fields[3]);
+        }
 
-        // rest of the expression is the PCRE
+        // rest of the expression is the PCRE, or for a literal its bytes
+        // with \xNN escapes
+        unsigned flag = fields.size() > 1 ? parseFlags(fields[1]) : 0;
         string pattern(line.substr(colonIdx + 1));
-        string p_string = parseEscapedString(pattern);
+        string p_string = (flag & HS_FLAG_PREFILTER) ? pattern : parseEscapedString(pattern);
 
         // printf("string is : %s, length: %lu\n", p_string.c_str(), p_string.length());
         size_t len = p_string.length();
         patterns.push_back(p_string);
         ids.push_back(id);
         lens.push_back(len);
+        flags.push_back(flag);
+        exts.push_back(ext);
     }
 }
 
@@ -419,7 +419,8 @@ void addLitExpression(NG &ng, unsigned index, const char *expression,
                            "HS_FLAG_SOM_LEFTMOST are supported in literal API.");
     }
 
-    if (!strcmp(expression, "")) {
+    // expression is length-delimited: a literal may start with (or be) NULs
+    if (!expLength) {
         // printf("index=%u, id=%u, flags=%u, expr='%s', len='%zu' is empty sting hence it is not considered\n", index,
         //          id, flags, (expression), expLength);
         return;
@@ -6,12 +6,17 @@ Script to convert a pcap file containing UDP and TCP packets to a corpus file.
 
 import sys, getopt, pprint, os
 from sqlite3 import dbapi2 as sqlite
-import pcap
 from optparse import OptionParser
 from socket import AF_INET, IPPROTO_UDP, IPPROTO_TCP, inet_ntop, ntohs, ntohl, inet_ntoa
 import struct
 from CorpusBuilder import CorpusBuilder
 
+# The capture reader shared with the rule engines in bin/: the pcap or
+# pcapng file is mmapped and packets are memoryview slices of it, so
+# headers and payloads below are views, not copies.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'bin'))
+from pcap_reader import PcapFile, network_layer
+
 ETHERTYPE_IP        = 0x0800    # IP protocol
 ETHERTYPE_ARP       = 0x0806    # Addr. resolution protocol
 ETHERTYPE_REVARP    = 0x8035    # reverse Addr. resolution protocol
@@ -35,7 +40,7 @@ cur_stream_id = 0
 def usage(exeName) :
     errmsg = "Usage: %s -i <pcap-file> -o <sqlite-file>"
     errmsg = errmsg % exeName
-    print >> sys.stderr, errmsg
+    print(errmsg, file=sys.stderr)
     sys.exit(-1)
 
 class FiveTuple(object):
@@ -67,18 +72,18 @@ class TcpSegment:
         self.tcp_sequence_number, self.tcp_acknowledgement_number = struct.unpack('!LL', header[4:12])
 
     def opt_isset_FIN(self):
-        opts = ord(self.tcp_header[13]) & 0x3F
+        opts = self.tcp_header[13] & 0x3F
         return (opts & 0x01)
 
     def opt_isset_SYN(self):
-        opts = ord(self.tcp_header[13]) & 0x3F
+        opts = self.tcp_header[13] & 0x3F
         return (opts & 0x02)
 
     def get_sequence_number(self):
         return self.tcp_sequence_number
 
-    def __cmp__(self, other):
-        return cmp(self.tcp_sequence_number, other.tcp_sequence_number)
+    def __lt__(self, other):
+        return self.tcp_sequence_number < other.tcp_sequence_number
 
 class TcpStream:
     """Definition of a TCP stream.
@@ -208,7 +213,7 @@ def enchunk_pcap(pcapFN, sqliteFN):
     """
 
     if not os.path.exists(pcapFN):
-        print >> sys.stderr, "Input file '%s' does not exist. Exiting." % pcapFN
+        print("Input file '%s' does not exist. Exiting." % pcapFN, file=sys.stderr)
         sys.exit(-1)
 
     builder = CorpusBuilder(sqliteFN)
@@ -220,37 +225,25 @@ def enchunk_pcap(pcapFN, sqliteFN):
     ip_pkt_cnt = 0
     ip_pkt_off = 0
     unsupported_ip_protocol_cnt = 0
-    pcap_ref = pcap.pcap(pcapFN)
-    done = False
-
-    while not done:
-        try:
-            ts, packet = pcap_ref.next()
-        except:
-            break
+    pcap_ref = PcapFile(pcapFN)
 
+    for ts, linktype, packet in pcap_ref:
         pkt_cnt += 1
 
-        linkLayerType = struct.unpack('!H', packet[(pcap_ref.dloff - 2):pcap_ref.dloff])[0]
         #
-        # We're only interested in IP packets
+        # We're only interested in IP packets; network_layer steps over
+        # any VLAN tags
         #
-        if linkLayerType == ETHERTYPE_VLAN:
-            linkLayerType = struct.unpack('!H', packet[(pcap_ref.dloff + 2):(pcap_ref.dloff + 4)])[0]
-            if linkLayerType != ETHERTYPE_IP:
-                continue
-            else:
-                ip_pkt_off = pcap_ref.dloff + 4
-        elif linkLayerType == ETHERTYPE_IP:
-            ip_pkt_off = pcap_ref.dloff
-        else:
+        layer = network_layer(packet, linktype)
+        if layer is None or layer[0] != ETHERTYPE_IP:
             continue
+        ip_pkt_off = layer[1]
 
         ip_pkt_cnt += 1
 
-        ip_pkt_total_len = struct.unpack('!H', packet[ip_pkt_off + 2: ip_pkt_off + 4])[0]
+        ip_pkt_total_len = struct.unpack_from('!H', packet, ip_pkt_off + 2)[0]
         ip_pkt = packet[ip_pkt_off:ip_pkt_off + ip_pkt_total_len]
-        pkt_protocol = struct.unpack('B', ip_pkt[9])[0]
+        pkt_protocol = ip_pkt[9]
 
         if (pkt_protocol != IPPROTO_UDP) and (pkt_protocol != IPPROTO_TCP):
             #
@@ -261,7 +254,7 @@ def enchunk_pcap(pcapFN, sqliteFN):
         pkt_src_addr = inet_ntoa(ip_pkt[12:16])
         pkt_dst_addr = inet_ntoa(ip_pkt[16:20])
 
-        ip_hdr_len_offset = (ord(ip_pkt[0]) & 0x0f) * 4
+        ip_hdr_len_offset = (ip_pkt[0] & 0x0f) * 4
         ip_payload = ip_pkt[ip_hdr_len_offset:len(ip_pkt)]
 
         pkt_src_port, pkt_dst_port = struct.unpack('!HH', ip_payload[0:4])
@@ -275,7 +268,7 @@ def enchunk_pcap(pcapFN, sqliteFN):
             udp_segment = UdpSegment(five_tuple, udp_header, udp_payload)
             process_udp_segment(builder, udp_segment)
         elif pkt_protocol == IPPROTO_TCP:
-            tcp_hdr_len = (ord(ip_payload[12]) >> 4) * 4
+            tcp_hdr_len = (ip_payload[12] >> 4) * 4
             tcp_header = ip_payload[0:tcp_hdr_len]
             tcp_payload = ip_payload[tcp_hdr_len:len(ip_payload)]
             segment = TcpSegment(five_tuple, tcp_header, tcp_payload)
@@ -285,16 +278,17 @@ def enchunk_pcap(pcapFN, sqliteFN):
     # Having read the contents of the pcap, we fill the database with any
     # remaining TCP and UDP segments
     #
-    for tcp_stream in tcp_streams.itervalues():
+    for tcp_stream in tcp_streams.values():
         db_add_tcp_stream_segments(builder, tcp_stream)
 
-    for udp_stream in udp_streams.itervalues():
+    for udp_stream in udp_streams.values():
         db_add_udp_stream_segments(builder, udp_stream)
 
     #
     # We've finished with the database
     #
     builder.finish()
+    pcap_ref.close()
 
 if __name__ == '__main__' :
 
@@ -303,7 +297,7 @@ if __name__ == '__main__' :
 
     requiredKeys = [ '-i', '-o']
     for k in requiredKeys :
-        if not args.has_key(k) :
+        if k not in args :
             usage(os.path.basename(sys.argv[0]))
 
     fnArgs = tuple([ args[k] for k in requiredKeys ])